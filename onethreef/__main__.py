@@ -1,44 +1,72 @@
 import asyncio
 import os
+from typing import Optional
 
+import requests
 import typer
-from sqlmodel import Session
-from tqdm import tqdm
-
-from onethreef import config, fetch
-from onethreef.constants import _create_engine, _init_connection, storage_path
-from onethreef.read import existing_ncs, process_infotable, process_submission, read_nc
-from onethreef.write import (
-    add_company,
-    add_filing,
-    add_portfolio,
-    check_company_exists,
-    check_filing_exists,
-    check_portfolio_exists,
-    create_portfolio_table,
+from aiohttp import web
+
+from onethreef import (
+    analytics,
+    catalog,
+    config,
+    fetch,
+    load,
+    rollup,
+    serve,
+    watch,
+    workqueue,
 )
+from onethreef.bulk import bulk_load
+from onethreef.constants import _init_connection, catalog_path, storage_path
+from onethreef.read import existing_ncs
 
 app = typer.Typer()
 
 
 @app.command()
-def download(year, quarter, date=None):
+def download(year, quarter, date=None, direct: bool = False):
     """CLI entrypoint for the 'download' command.
     E.g. following command
     $ onethreef download 2016 1
     downloads all filings from the first quarter of 2016.
     The date argument can be used to only download a single feed.
+    With --direct, only the 13F filings themselves are downloaded from the EDGAR
+    archives as .nc files instead of the daily feeds, so no 'unpack' is needed.
+    The filings are looked up in the local catalog if it has the complete quarter
+    (see 'catalog'), otherwise in the quarter's form.idx.
 
     Args:
         year (int): The year.
         quarter (int): The quarter.
         date (str): The date of a single feed (e.g. 20150102).
+        direct (bool): Downloads individual filings instead of feeds if True.
 
     Returns:
         Nothing.
 
     """
 
+    if direct:
+        typer.echo(f"\n\n############# {year}/QTR{quarter} #############")
+        filings = None
+        if os.path.exists(catalog_path):
+            conn = catalog.connect_catalog()
+            filings = catalog.filing_paths(conn, year, quarter)
+            conn.close()
+        if filings is None:
+            try:
+                filings = fetch.fetch_filing_paths(year, quarter)
+            except requests.HTTPError as e:
+                typer.echo(f"couldn't fetch the form.idx of {year}/QTR{quarter}: {e}")
+                raise typer.Exit(code=1)
+        if date is not None:
+            filings = [f for f in filings if f[0] == date]
+        failed = asyncio.run(fetch.download_filings(year, quarter, filings))
+        if len(failed) > 0:
+            typer.echo(f"{len(failed)} of {len(filings)} filings failed to download")
+        return
+
     if date is None:
         typer.echo(f"\n\n############# {year}/QTR{quarter} #############")
         dates, accnos = fetch.fetch_index(year, quarter)
@@ -49,6 +77,36 @@ def download(year, quarter, date=None):
     asyncio.run(fetch.download_feeds(year, quarter, dates, MAX_TASKS=10))
 
 
+@app.command("catalog")
+def catalog_(
+    start_year: int = 1993, end_year: Optional[int] = None, refresh: bool = False
+):
+    """CLI entrypoint for the 'catalog' command.
+    E.g. the following command
+    $ onethreef catalog --start-year 2013
+    adds the form.idx of every quarter since 2013 to the local catalog
+    (catalog.sqlite in the storage path). Quarters that are already complete in
+    the catalog are skipped, so running it again only fetches the running quarter.
+
+    Args:
+        start_year (int): The first year.
+        end_year (int): The last year. Defaults to the current year.
+        refresh (bool): Loads complete quarters again if True.
+
+    Returns:
+        Nothing.
+
+    """
+
+    conn = catalog.connect_catalog()
+    for (year, quarter), rows in catalog.update_catalog(
+        conn, start_year=start_year, end_year=end_year, refresh=refresh
+    ).items():
+        typer.echo(f"{year}/QTR{quarter}: {rows} filings")
+    typer.echo(f"{catalog.count_filings(conn)} filings in the catalog")
+    conn.close()
+
+
 @app.command()
 def unpack(year, quarter, date=None, delete_feeds=False):
     """CLI entrypoint for the 'unpack' command.
@@ -84,71 +142,304 @@ def unpack(year, quarter, date=None, delete_feeds=False):
 
 
 @app.command()
-def to_database(year, quarter, filename=None):
+def to_database(
+    year,
+    quarter,
+    filename=None,
+    use_cache: bool = True,
+    batch: bool = False,
+    max_memory_mb: Optional[int] = None,
+    bulk: bool = False,
+    batch_size: int = 500,
+    compact: bool = False,
+):
     """CLI entrypoint for the 'to-database' command.
     E.g. the following command
     $ onethreef 2016 1
     writes all .nc files in 2016/QTR1 to the database.
+    With --batch, filings that fail to load are skipped and recorded in the
+    quarter's failed.jsonl instead of aborting the run (see 'retry-failed').
+    With --max-memory-mb, info tables are streamed into the database in chunks
+    that fit into the given memory, no matter how large a filing is.
+    With --bulk, positions are staged in an unlogged relation without keys and
+    committed every batch_size filings. Keys, constraints and statistics are
+    built once at the end. Meant for initial loads of historical quarters.
+    With --compact, each company's positions are stored in full only every few
+    filings and as changes to the previous filing otherwise (see delta.py).
 
     Args:
         year (int): The year.
         quarter (int): The quarter.
         filename (str): Filename of a .nc file to only write this specific file to the database.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        batch (bool): Isolates failing filings if True.
+        max_memory_mb (int): Streams info tables within this memory ceiling if set.
+        bulk (bool): Loads through the unlogged staging relation if True.
+        batch_size (int): The number of filings per commit in bulk mode.
+        compact (bool): Writes positions to compact storage if True.
 
     Returns:
         Nothing.
 
     """
 
-    engine = _create_engine()
-
     if filename is None:
         ncs = existing_ncs(year, quarter)
     else:
         ncs = [os.path.join(storage_path, str(year), f"QTR{quarter}", filename)]
 
+    if bulk and compact:
+        raise typer.BadParameter("--bulk and --compact can't be combined")
+
+    chunk_rows = None if max_memory_mb is None else load.chunk_rows_for(max_memory_mb)
+    if bulk:
+        failed = bulk_load(
+            ncs,
+            batch=batch,
+            use_cache=use_cache,
+            batch_size=batch_size,
+            chunk_rows=chunk_rows,
+        )
+    else:
+        failed = load.load_filings(
+            ncs,
+            batch=batch,
+            use_cache=use_cache,
+            chunk_rows=chunk_rows,
+            compact=compact,
+        )
+    if len(failed) > 0:
+        typer.echo(f"{len(failed)} of {len(ncs)} filings failed, see failed.jsonl")
+
+
+@app.command()
+def retry_failed(
+    year,
+    quarter,
+    use_cache: bool = True,
+    max_memory_mb: Optional[int] = None,
+    compact: bool = False,
+):
+    """CLI entrypoint for the 'retry-failed' command.
+    E.g. the following command
+    $ onethreef retry-failed 2016 1
+    reloads only the filings of 2016/QTR1 that failed in a previous
+    'to-database --batch' run. Filings that fail again stay in failed.jsonl.
+
+    Args:
+        year (int): The year.
+        quarter (int): The quarter.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        max_memory_mb (int): Streams info tables within this memory ceiling if set.
+        compact (bool): Writes positions to compact storage if True.
+
+    Returns:
+        Nothing.
+
+    """
+
+    failed = load.retry_failed(
+        os.path.join(storage_path, str(year), f"QTR{quarter}"),
+        use_cache=use_cache,
+        chunk_rows=(
+            None if max_memory_mb is None else load.chunk_rows_for(max_memory_mb)
+        ),
+        compact=compact,
+    )
+    typer.echo(f"{len(failed)} filings failed again")
+
+
+@app.command()
+def enqueue(year, quarter):
+    """CLI entrypoint for the 'enqueue' command.
+    E.g. the following command
+    $ onethreef enqueue 2016 1
+    adds all .nc files in 2016/QTR1 to the database's work queue. The queued
+    filings are loaded by any number of 'work' processes on any number of hosts.
+
+    Args:
+        year (int): The year.
+        quarter (int): The quarter.
+
+    Returns:
+        Nothing.
+
+    """
+
+    conn = _init_connection()
+    n = workqueue.enqueue(conn, existing_ncs(year, quarter))
+    typer.echo(f"{n} filings queued, {workqueue.queue_status(conn)}")
+    conn.close()
+
+
+@app.command()
+def work(
+    worker=None,
+    poll_interval: float = 5,
+    heartbeat_interval: float = 10,
+    stale_after: float = 60,
+    max_attempts: int = 3,
+    exit_when_empty: bool = False,
+    use_cache: bool = True,
+    max_memory_mb: Optional[int] = None,
+):
+    """CLI entrypoint for the 'work' command.
+    E.g. the following command
+    $ onethreef work --exit-when-empty
+    claims filings from the database's work queue and writes them to the database
+    until the queue is empty. Items of workers that stop sending heartbeats for
+    stale_after seconds are handed to other workers.
+
+    Args:
+        worker (str): The worker's id. Defaults to {hostname}-{pid}.
+        poll_interval (float): Seconds to wait before polling an empty queue again.
+        heartbeat_interval (float): Seconds between two heartbeats.
+        stale_after (float): Seconds without heartbeat after which an item is reassigned.
+        max_attempts (int): The number of attempts before an item is marked as failed.
+        exit_when_empty (bool): Stops once no item is pending or running if True.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        max_memory_mb (int): Streams info tables within this memory ceiling if set.
+
+    Returns:
+        Nothing.
+
+    """
+
+    n = workqueue.run_worker(
+        worker=worker,
+        poll_interval=poll_interval,
+        heartbeat_interval=heartbeat_interval,
+        stale_after=stale_after,
+        max_attempts=max_attempts,
+        exit_when_empty=exit_when_empty,
+        use_cache=use_cache,
+        chunk_rows=(
+            None if max_memory_mb is None else load.chunk_rows_for(max_memory_mb)
+        ),
+    )
+    typer.echo(f"{n} filings loaded")
+
+
+@app.command("watch")
+def watch_(
+    poll_interval: float = 60,
+    max_inflight: int = 50,
+    workers: int = 4,
+    index_file=None,
+    use_cache: bool = True,
+):
+    """CLI entrypoint for the 'watch' command.
+    E.g. the following command
+    $ onethreef watch --poll-interval 30
+    polls EDGAR's daily index every 30 seconds and downloads and writes every new
+    13F filing to the database as soon as it shows up. Runs until it's interrupted.
+
+    Args:
+        poll_interval (float): Seconds between two polls of the daily index.
+        max_inflight (int): The maximum number of filings waiting for download or load.
+        workers (int): The number of concurrent downloads.
+        index_file (str): Polls this local index file instead of EDGAR if set.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+
+    Returns:
+        Nothing.
+
+    """
+
+    asyncio.run(
+        watch.watch(
+            poll_interval=poll_interval,
+            max_inflight=max_inflight,
+            workers=workers,
+            index_file=index_file,
+            use_cache=use_cache,
+        )
+    )
+
+
+@app.command("serve")
+def serve_(
+    host="0.0.0.0",
+    port: int = 8080,
+    pool_size: int = 10,
+    cache_size: int = 1024,
+    ttl: int = 300,
+):
+    """CLI entrypoint for the 'serve' command.
+    E.g. the following command
+    $ onethreef serve --port 8080
+    starts a read-only HTTP service with the endpoints /portfolio/{cik},
+    /holders/{cusip} and /filing/{accnumber}. Responses are cached in memory and
+    invalidated as soon as 'to-database' writes a new filing.
+
+    Args:
+        host (str): The interface to bind to.
+        port (int): The port to listen on.
+        pool_size (int): The maximum number of pooled database connections.
+        cache_size (int): The maximum number of cached responses.
+        ttl (int): Seconds a cached response stays valid.
+
+    Returns:
+        Nothing.
+
+    """
+
+    web.run_app(
+        serve.create_app(pool_size=pool_size, cache_size=cache_size, ttl=ttl),
+        host=host,
+        port=port,
+    )
+
+
+@app.command("rollup")
+def rollup_():
+    """CLI entrypoint for the 'rollup' command.
+    E.g. the following command
+    $ onethreef rollup
+    adds all filings in the database that aren't part of the rollup relations yet
+    to the rollups. 'to-database' keeps the rollups up to date on its own, this is
+    only required once for databases loaded before the rollups existed.
+
+    Returns:
+        Nothing.
+
+    """
+
     conn = _init_connection()
-    with Session(engine) as sess:
-        for nc in tqdm(ncs):
-            s, i = read_nc(nc)
-            s_dict = process_submission(s)
-
-            # Company
-            company_id = check_company_exists(sess, s_dict["cik"])
-            if company_id:
-                pass
-            else:
-                add_company(sess, s_dict)
-                company_id = check_company_exists(sess, s_dict["cik"])
-
-            # Filing
-            filing_id = check_filing_exists(sess, nc.split("/")[-1].rstrip(".nc"))
-            if filing_id:
-                pass
-            else:
-                add_filing(
-                    sess,
-                    s_dict,
-                    company_id=company_id,
-                    accnumber=nc.split("/")[-1].rstrip(".nc"),
-                )
-                filing_id = check_filing_exists(sess, nc.split("/")[-1].rstrip(".nc"))
-
-            sess.commit()
-
-            # Portfolio
-            if check_portfolio_exists(conn, s_dict["cik"]):
-                pass
-            else:
-                print(nc)
-                create_portfolio_table(conn, s_dict["cik"])
-                df = process_infotable(i, filing_id=filing_id)
-                add_portfolio(conn, df, f"c{s_dict['cik']}")
-
-    conn.commit()
+    rollup.sync_rollups(conn)
     conn.close()
 
 
+@app.command()
+def analyze(year, quarter, k: int = 10, refresh: bool = False):
+    """CLI entrypoint for the 'analyze' command.
+    E.g. the following command
+    $ onethreef analyze 2016 1 --k 5
+    builds (or loads the cached) filer x security matrix of the reports for the
+    period 2016-03-31 (filed in 2016/QTR2 and 2016/QTR3) and writes the 5 most
+    similar filers of each filer to similarity.csv and the securities' crowding
+    scores to crowding.csv in the 2016/QTR1 directory.
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+        k (int): The number of similar filers per filer.
+        refresh (bool): Rebuilds the cached matrix from the .nc files if True.
+
+    Returns:
+        Nothing.
+
+    """
+
+    typer.echo(f"\n\n############# {year}/QTR{quarter} #############")
+    m, ciks, cusips = analytics.quarter_matrix(year, quarter, refresh=refresh)
+    quarter_dir = os.path.join(storage_path, str(year), f"QTR{quarter}")
+    analytics.top_k_similar(m, ciks, k=k).to_csv(
+        os.path.join(quarter_dir, "similarity.csv"), index=False
+    )
+    analytics.crowding(m, cusips).to_csv(os.path.join(quarter_dir, "crowding.csv"))
+
+
 def main():
     """The main CLI entrypoint"""
 
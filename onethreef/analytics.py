@@ -0,0 +1,366 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from tqdm import tqdm
+
+from onethreef.cache import parse_nc
+from onethreef.constants import storage_path
+from onethreef.read import existing_ncs
+
+
+def matrix_path(year, quarter):
+    """A helper function that returns the path of a reporting period's cached matrix.
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+
+    Returns:
+        str: The absolute path of the matrix.npz file in the period's quarter
+            directory.
+
+    """
+
+    return os.path.join(storage_path, str(year), f"QTR{quarter}", "matrix.npz")
+
+
+def period_of_report(year, quarter):
+    """A helper function that returns the last day of a quarter, i.e. the
+    periodOfReport of the 13F reports for that quarter.
+
+    Args:
+        year (int): The year.
+        quarter (int): The quarter.
+
+    Returns:
+        pd.Timestamp: The last day of the quarter.
+
+    """
+
+    return pd.Period(
+        year=int(year), quarter=int(quarter), freq="Q"
+    ).end_time.normalize()
+
+
+def period_ncs(year, quarter, filing_quarters=2):
+    """A function that returns the .nc files that can hold reports of a period.
+    13F reports are due 45 days after the end of the quarter, so they are filed in
+    the following quarter. Late reports and amendments are picked up from the
+    filing_quarters quarters after the period.
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+        filing_quarters (int): The number of filing quarters to read.
+
+    Returns:
+        list: The absolute paths of the .nc files.
+
+    """
+
+    period = pd.Period(year=int(year), quarter=int(quarter), freq="Q")
+    ncs = []
+    for i in range(1, filing_quarters + 1):
+        filed = period + i
+        ncs.extend(existing_ncs(filed.year, filed.quarter))
+
+    return ncs
+
+
+def quarter_fingerprint(year, quarter):
+    """A function that fingerprints the .nc files of a reporting period (see
+    period_ncs()). The fingerprint changes whenever a file is added, removed or
+    rewritten (e.g. by 'download --direct' or 'watch').
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+
+    Returns:
+        str: A sha1 hex digest of the files' names, sizes and modification times.
+
+    """
+
+    h = hashlib.sha1()
+    for nc in sorted(period_ncs(year, quarter)):
+        st = os.stat(nc)
+        h.update(f"{nc}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+
+    return h.hexdigest()
+
+
+def active_filings(filings):
+    """A function that decides which filings count towards their report (cik and
+    period), with the same rules as the rollups (see update_rollups()). Filings
+    are ordered by signature date and acc number. The latest original report or
+    restatement replaces all earlier filings of the report, 'NEW HOLDINGS'
+    amendments filed after it add to it.
+
+    Args:
+        filings (pd.DataFrame): A dataframe with the columns cik, periodofreport,
+            signaturedate, accnumber and amendmenttype.
+
+    Returns:
+        pd.Series: A boolean mask aligned with filings.
+
+    """
+
+    ordered = filings.sort_values(["signaturedate", "accnumber"])
+    report = [ordered.cik, ordered.periodofreport]
+    n = ordered.groupby(report).cumcount()
+    new_holdings = ordered.amendmenttype == "NEW HOLDINGS"
+    base = n.where(~new_holdings).groupby(report).transform("max")
+    active = base.isna() | (new_holdings & (n > base)) | (~new_holdings & (n == base))
+
+    return active.reindex(filings.index)
+
+
+def quarter_holdings(year, quarter):
+    """A function that collects the holdings reported for a period from the .nc
+    files filed after it (see period_ncs()). Only the active filings of each
+    report count (see active_filings()).
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+
+    Returns:
+        pd.DataFrame: A long dataframe with the columns cik, cusip and value.
+
+    """
+
+    period = period_of_report(year, quarter)
+    filings, frames = [], []
+    for nc in tqdm(period_ncs(year, quarter), desc=f"{year}/QTR{quarter}"):
+        s_dict, df = parse_nc(nc)
+        if s_dict["periodOfReport"] != period:
+            continue
+        filings.append(
+            {
+                "cik": s_dict["cik"],
+                "periodofreport": s_dict["periodOfReport"],
+                "signaturedate": s_dict["signatureDate"],
+                "accnumber": os.path.basename(nc)[: -len(".nc")],
+                "amendmenttype": s_dict.get("amendmentType"),
+            }
+        )
+        frames.append(df[["cusip", "value"]].assign(cik=s_dict["cik"]))
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=["cik", "cusip", "value"])
+
+    active = active_filings(pd.DataFrame(filings))
+    frames = [f for f, a in zip(frames, active) if a]
+
+    return pd.concat(frames, ignore_index=True)[["cik", "cusip", "value"]]
+
+
+def build_matrix(holdings):
+    """A function that builds a sparse filer x security matrix of position weights.
+    Positions of the same filer and cusip are summed up (e.g. multiple managers or
+    a 'NEW HOLDINGS' amendment). Each row is then divided by the filer's total
+    value, so every entry is the position's share of the filer's reported portfolio.
+
+    Args:
+        holdings (pd.DataFrame): A dataframe with the columns cik, cusip and value.
+
+    Returns:
+        tuple(scipy.sparse.csr_matrix, np.ndarray, np.ndarray): The weight matrix,
+            the ciks (row labels) and the cusips (column labels).
+
+    """
+
+    holdings = holdings[holdings.value > 0]
+    rows, ciks = pd.factorize(holdings.cik, sort=True)
+    cols, cusips = pd.factorize(holdings.cusip, sort=True)
+    m = sparse.csr_matrix(
+        (holdings.value.to_numpy(dtype=np.float64), (rows, cols)),
+        shape=(len(ciks), len(cusips)),
+    )
+    m.sum_duplicates()
+
+    totals = np.asarray(m.sum(axis=1)).ravel()
+    totals[totals == 0] = 1
+    m = sparse.diags(1 / totals) @ m
+
+    return (m.tocsr(), np.asarray(ciks, dtype=str), np.asarray(cusips, dtype=str))
+
+
+def save_matrix(path, m, ciks, cusips, fingerprint=""):
+    """A function that writes a weight matrix and its labels to a .npz file.
+
+    Args:
+        path (str): The absolute filepath.
+        m (scipy.sparse.csr_matrix): The weight matrix.
+        ciks (np.ndarray): The row labels.
+        cusips (np.ndarray): The column labels.
+        fingerprint (str): The fingerprint of the matrix's input files
+            (see quarter_fingerprint()).
+
+    Returns:
+        Nothing.
+
+    """
+
+    np.savez_compressed(
+        path,
+        data=m.data,
+        indices=m.indices,
+        indptr=m.indptr,
+        shape=np.array(m.shape),
+        ciks=ciks,
+        cusips=cusips,
+        fingerprint=np.array(fingerprint),
+    )
+
+
+def load_matrix(path, fingerprint=None):
+    """A function that reads a weight matrix written by save_matrix().
+
+    Args:
+        path (str): The absolute filepath.
+        fingerprint (str): Only returns the matrix if it was saved with this
+            fingerprint if set.
+
+    Returns:
+        tuple(scipy.sparse.csr_matrix, np.ndarray, np.ndarray): The weight matrix,
+            the ciks (row labels) and the cusips (column labels). None if the
+            fingerprint doesn't match.
+
+    """
+
+    with np.load(path) as f:
+        if fingerprint is not None and (
+            "fingerprint" not in f or str(f["fingerprint"]) != fingerprint
+        ):
+            return None
+        m = sparse.csr_matrix(
+            (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+        )
+        return (m, f["ciks"], f["cusips"])
+
+
+def quarter_matrix(year, quarter, refresh=False):
+    """A function that returns the weight matrix of a reporting period.
+    The matrix is cached as matrix.npz in the period's quarter directory and only
+    rebuilt from the .nc files if it doesn't exist yet, the period's .nc files
+    changed since it was built (see quarter_fingerprint()) or refresh is True.
+
+    Args:
+        year (int): The year of the reporting period.
+        quarter (int): The quarter of the reporting period.
+        refresh (bool): Rebuilds the cached matrix if True.
+
+    Returns:
+        tuple(scipy.sparse.csr_matrix, np.ndarray, np.ndarray): The weight matrix,
+            the ciks (row labels) and the cusips (column labels).
+
+    """
+
+    path = matrix_path(year, quarter)
+    fingerprint = quarter_fingerprint(year, quarter)
+    if os.path.exists(path) and not refresh:
+        cached = load_matrix(path, fingerprint=fingerprint)
+        if cached is not None:
+            return cached
+
+    m, ciks, cusips = build_matrix(quarter_holdings(year, quarter))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_matrix(path, m, ciks, cusips, fingerprint=fingerprint)
+
+    return (m, ciks, cusips)
+
+
+def top_k_similar(m, ciks, k=10, block_size=1024):
+    """A function that finds the k most similar filers of each filer.
+    Similarity is the cosine similarity of the filers' weight vectors. The rows are
+    L2-normalized once and the similarity is computed as a sparse matrix product
+    in blocks of rows, so memory stays at block_size x number of filers. Filers
+    without any common security (similarity 0) are never listed, so a filer can
+    have fewer than k similar filers.
+
+    Args:
+        m (scipy.sparse.csr_matrix): The weight matrix.
+        ciks (np.ndarray): The row labels.
+        k (int): The number of similar filers to return per filer.
+        block_size (int): The number of rows to compute at once.
+
+    Returns:
+        pd.DataFrame: A dataframe with the columns cik, similar_cik, similarity and rank.
+
+    """
+
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    mn = (sparse.diags(1 / norms) @ m).tocsr()
+    mt = mn.T.tocsc()
+    k = min(k, mn.shape[0] - 1)
+
+    if k < 1:
+        return pd.DataFrame(columns=["cik", "similar_cik", "similarity", "rank"])
+
+    results = []
+    for start in range(0, mn.shape[0], block_size):
+        sim = (mn[start : start + block_size] @ mt).toarray()
+        rows = np.arange(sim.shape[0])
+        sim[rows, rows + start] = -1
+
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        top_sim = np.take_along_axis(sim, top, axis=1)
+        order = np.argsort(-top_sim, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_sim = np.take_along_axis(top_sim, order, axis=1)
+
+        results.append(
+            pd.DataFrame(
+                {
+                    "cik": np.repeat(ciks[start : start + sim.shape[0]], k),
+                    "similar_cik": ciks[top.ravel()],
+                    "similarity": top_sim.ravel(),
+                    "rank": np.tile(np.arange(1, k + 1), sim.shape[0]),
+                }
+            )
+        )
+
+    df = pd.concat(results, ignore_index=True)
+
+    return df[df.similarity > 0].reset_index(drop=True)
+
+
+def crowding(m, cusips):
+    """A function that computes per security crowding scores.
+    For every security the function returns the number of holders, the sum of all
+    filers' portfolio weights (how many 'portfolios' are invested in the security),
+    the average weight among its holders and the Herfindahl index of the weights
+    (1 means a single filer dominates, close to 0 means a crowded name).
+
+    Args:
+        m (scipy.sparse.csr_matrix): The weight matrix.
+        cusips (np.ndarray): The column labels.
+
+    Returns:
+        pd.DataFrame: A dataframe indexed by cusip, sorted by crowding descending.
+
+    """
+
+    mc = m.tocsc()
+    holders = np.diff(mc.indptr)
+    weight = np.asarray(mc.sum(axis=0)).ravel()
+    squares = np.asarray(mc.multiply(mc).sum(axis=0)).ravel()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        avg_weight = np.where(holders > 0, weight / holders, 0)
+        hhi = np.where(weight > 0, squares / weight ** 2, 0)
+
+    return pd.DataFrame(
+        {
+            "holders": holders,
+            "crowding": weight,
+            "avg_weight": avg_weight,
+            "hhi": hhi,
+        },
+        index=pd.Index(cusips, name="cusip"),
+    ).sort_values("crowding", ascending=False)
@@ -0,0 +1,318 @@
+import io
+
+from sqlmodel import Session
+from tqdm import tqdm
+
+from onethreef import delta, rollup
+from onethreef.cache import parse_nc
+from onethreef.constants import _create_engine, _init_connection, empty_df
+from onethreef.load import nc_accnumber, record_failure
+from onethreef.read import stream_nc
+from onethreef.write import (
+    add_company,
+    add_filing,
+    check_company_exists,
+    check_filing_exists,
+    check_filing_portfolio_exists,
+    check_portfolio_exists,
+    notify_filing,
+    run_query,
+)
+
+portfolio_columns = list(empty_df.columns)
+
+
+def create_staging_table(conn):
+    """Database query to create the 'portfolio_staging' relation if it doesn't exist yet.
+    The relation is UNLOGGED and has no keys or indexes, so inserts skip the
+    write-ahead log and all constraint checks. It holds the positions of all
+    filings of a bulk load together with their company's cik.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        Nothing.
+
+    """
+
+    q = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS portfolio_staging (
+        cik VARCHAR,
+        portfolio_id INTEGER,
+        nameofissuer VARCHAR,
+        titleofclass VARCHAR,
+        cusip VARCHAR,
+        value BIGINT,
+        sshprnamt BIGINT,
+        sshprnamttype VARCHAR,
+        investmentdiscretion VARCHAR,
+        sole BIGINT,
+        shared BIGINT,
+        nonne BIGINT,
+        putcall VARCHAR,
+        othermanager VARCHAR,
+        filing_id BIGINT
+    );
+    """
+    with conn.cursor() as cur:
+        cur.execute(q)
+    conn.commit()
+
+
+def lock_staging(conn):
+    """Database query that takes the session-level advisory lock on
+    'portfolio_staging'. Waits for the lock if another bulk load holds it. The
+    lock is held until the connection is closed.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        Nothing.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(hashtext('portfolio_staging'))")
+        if not cur.fetchone()[0]:
+            print("waiting for another bulk load to finish")
+            cur.execute("SELECT pg_advisory_lock(hashtext('portfolio_staging'))")
+    conn.commit()
+
+
+def stage_portfolio(cur, df, cik):
+    """Database query that copies a preprocessed info table into 'portfolio_staging'.
+    Uses COPY instead of INSERT and doesn't commit.
+
+    Args:
+        cur (psycopg2.extensions.cursor): A psycopg2 cursor.
+        df (pd.DataFrame): The preprocessed info table including filing_id.
+        cik (str): A unique company identifier (e.g. 0001162781).
+
+    Returns:
+        Nothing.
+
+    """
+
+    buf = io.StringIO()
+    df[portfolio_columns].assign(cik=cik)[["cik"] + portfolio_columns].to_csv(
+        buf, index=False, header=False
+    )
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY portfolio_staging (cik,{','.join(portfolio_columns)}) FROM STDIN WITH CSV",
+        buf,
+    )
+
+
+def _filing_stored(conn, cik, filing_id):
+    """Helper function that checks whether a filing's positions are already stored
+    in its company's portfolio relation or in compact storage.
+
+    """
+
+    if delta.check_compact_portfolio_exists(conn, filing_id):
+        return True
+    if not check_portfolio_exists(conn, cik):
+        return False
+
+    return check_filing_portfolio_exists(conn, cik, filing_id)
+
+
+def stage_filing(sess, cur, nc, staged, use_cache=True, chunk_rows=None):
+    """A function that adds a filing's company and filing records and stages its
+    positions. Nothing is committed, the caller commits in batches.
+
+    Args:
+        sess (sqlmodel.orm.session.Session): A SQLModel session.
+        cur (psycopg2.extensions.cursor): A psycopg2 cursor.
+        nc (str): The absolute filepath of the .nc file.
+        staged (set): The filing_ids that are already staged.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        chunk_rows (int): Streams the info table in chunks of this many rows if set.
+
+    Returns:
+        tuple(str, str): The cik and acc number if the filing was staged, None if
+            its positions are already stored.
+
+    """
+
+    if chunk_rows is None:
+        s_dict, df = parse_nc(nc, use_cache=use_cache)
+        chunks = [df]
+    else:
+        s_dict, chunks = stream_nc(nc, chunk_rows=chunk_rows)
+    accnumber = nc_accnumber(nc)
+
+    company_id = check_company_exists(sess, s_dict["cik"])
+    if company_id is None:
+        add_company(sess, s_dict)
+        company_id = check_company_exists(sess, s_dict["cik"])
+
+    filing_id = check_filing_exists(sess, accnumber)
+    if filing_id is None:
+        add_filing(sess, s_dict, company_id=company_id, accnumber=accnumber)
+        filing_id = check_filing_exists(sess, accnumber)
+    elif filing_id in staged or _filing_stored(
+        cur.connection, s_dict["cik"], filing_id
+    ):
+        return None
+
+    rollup.record_amendment(
+        cur.connection, filing_id, s_dict.get("amendmentType"), commit=False
+    )
+    for df in chunks:
+        stage_portfolio(cur, df.assign(filing_id=filing_id), s_dict["cik"])
+    staged.add(filing_id)
+
+    return (s_dict["cik"], accnumber)
+
+
+def swap_in(conn):
+    """A function that moves all staged positions into the portfolio relations.
+    Companies without a portfolio relation get a new one built with CREATE TABLE
+    AS, after which the primary key is built in one pass and the foreign key is
+    added NOT VALID and validated with a single scan. Existing relations get the
+    staged rows with one set-based INSERT ... SELECT. Each company is swapped in
+    its own transaction.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        list: The ciks whose portfolio relations changed.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS portfolio_staging_cik ON portfolio_staging (cik)"
+        )
+        cur.execute("ANALYZE portfolio_staging")
+    conn.commit()
+
+    ciks = [
+        r[0]
+        for r in run_query(conn, "SELECT DISTINCT cik FROM portfolio_staging")
+        if r[0].isdigit()
+    ]
+    cols = ",".join(portfolio_columns)
+
+    for cik in tqdm(ciks, desc="swap"):
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"c{cik}",))
+            if check_portfolio_exists(conn, cik):
+                cur.execute(
+                    f"INSERT INTO c{cik} ({cols}) SELECT {cols} FROM portfolio_staging WHERE cik = %s",
+                    (cik,),
+                )
+            else:
+                cur.execute(
+                    f"CREATE TABLE c{cik} AS SELECT {cols} FROM portfolio_staging WHERE cik = %s",
+                    (cik,),
+                )
+                cur.execute(
+                    f"""
+                    ALTER TABLE c{cik}
+                    ADD CONSTRAINT c{cik}_pkey PRIMARY KEY (portfolio_id, filing_id),
+                    ADD CONSTRAINT c{cik}_filing_id_fkey FOREIGN KEY (filing_id)
+                    REFERENCES filing(filing_id) NOT VALID;
+                    ALTER TABLE c{cik} VALIDATE CONSTRAINT c{cik}_filing_id_fkey;
+                    """
+                )
+        conn.commit()
+
+    return ciks
+
+
+def bulk_load(ncs, batch=False, use_cache=True, batch_size=500, chunk_rows=None):
+    """A function that writes a list of .nc files to the database for initial loads.
+    Instead of inserting into the portfolio relations filing by filing, all
+    positions are copied into the unlogged, unindexed 'portfolio_staging' relation
+    and committed every batch_size filings. At the end the staged positions are
+    swapped into the portfolio relations (see swap_in()), the rollups of the
+    swapped in companies are built from them (see sync_rollups()), the staging
+    relation is dropped and all touched relations are analyzed.
+
+    An interrupted bulk load can simply be started again: filings that are
+    already staged or stored are skipped. In batch mode failing filings are
+    rolled back to a savepoint and recorded in the dead letter file, the rest of
+    the batch is kept. Bulk loads share the staging relation, so a bulk load
+    holds an advisory lock on it for its whole run and a concurrent one waits
+    until it's done.
+
+    Args:
+        ncs (list): A list of absolute filepaths of .nc files.
+        batch (bool): Isolates failing filings if True.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        batch_size (int): The number of filings per commit.
+        chunk_rows (int): Streams info tables in chunks of this many rows if set.
+
+    Returns:
+        list: The filepaths of the filings that failed (only in batch mode).
+
+    """
+
+    engine = _create_engine()
+    conn = _init_connection()
+    lock_staging(conn)
+    rollup.create_rollup_tables(conn)
+    create_staging_table(conn)
+    staged = {
+        r[0]
+        for r in run_query(conn, "SELECT DISTINCT filing_id FROM portfolio_staging")
+    }
+    loaded, failed = [], []
+
+    try:
+        with Session(engine) as sess:
+            for i, nc in enumerate(tqdm(ncs)):
+                with conn.cursor() as cur:
+                    nested = sess.begin_nested()
+                    cur.execute("SAVEPOINT filing")
+                    try:
+                        item = stage_filing(
+                            sess,
+                            cur,
+                            nc,
+                            staged,
+                            use_cache=use_cache,
+                            chunk_rows=chunk_rows,
+                        )
+                        nested.commit()
+                        if item is not None:
+                            loaded.append(item)
+                    except Exception as e:
+                        if not batch:
+                            raise
+                        nested.rollback()
+                        cur.execute("ROLLBACK TO SAVEPOINT filing")
+                        record_failure(nc, e)
+                        failed.append(nc)
+
+                if (i + 1) % batch_size == 0:
+                    sess.commit()
+                    conn.commit()
+
+            sess.commit()
+            conn.commit()
+
+        ciks = swap_in(conn)
+        rollup.sync_rollups(conn, ciks=ciks)
+
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE portfolio_staging")
+            for table in ["company", "filing", "filer_rollup", "security_rollup"] + [
+                f"c{cik}" for cik in ciks
+            ]:
+                cur.execute(f"ANALYZE {table}")
+        conn.autocommit = False
+
+        for cik, accnumber in loaded:
+            notify_filing(conn, cik, accnumber)
+    finally:
+        conn.close()
+
+    return failed
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import pathlib
+from datetime import datetime as dt
+
+import pandas as pd
+
+from onethreef import config
+from onethreef.constants import parse_cache_path
+from onethreef.read import process_infotable, process_submission, read_nc
+
+cache_version = 2
+_cache_bytes = None
+
+
+def file_hash(filename):
+    """A function that computes the content hash of a file.
+    The file is read in chunks, which is much cheaper than parsing its XML.
+
+    Args:
+        filename (str): The absolute filepath.
+
+    Returns:
+        str: The hex digest of the file's content.
+
+    """
+
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _entry_paths(key):
+    """Helper function that returns the submission and holdings path of a cache key."""
+
+    return (
+        os.path.join(parse_cache_path, f"{key}.json"),
+        os.path.join(parse_cache_path, f"{key}.feather"),
+    )
+
+
+def _cache_size():
+    """Helper function that returns the size of the cache directory in bytes.
+    The directory is only scanned once per process, afterwards the size is tracked
+    by store_parsed() and evict().
+
+    """
+
+    global _cache_bytes
+
+    if _cache_bytes is None:
+        try:
+            _cache_bytes = sum(e.stat().st_size for e in os.scandir(parse_cache_path))
+        except FileNotFoundError:
+            _cache_bytes = 0
+
+    return _cache_bytes
+
+
+def load_parsed(key):
+    """A function that reads a parsed filing from the cache.
+    A hit touches the entry, so the eviction drops the least recently used filings.
+
+    Args:
+        key (str): The cache key (see file_hash()).
+
+    Returns:
+        tuple(dict, pd.DataFrame): The processed submission and info table or None
+            if the filing isn't cached.
+
+    """
+
+    s_path, i_path = _entry_paths(key)
+
+    try:
+        with open(s_path, "r") as f:
+            s_dict = json.load(f)
+        df = pd.read_feather(i_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    for k in ["periodOfReport", "signatureDate"]:
+        s_dict[k] = dt.fromisoformat(s_dict[k])
+
+    for path in [s_path, i_path]:
+        os.utime(path)
+
+    return (s_dict, df)
+
+
+def store_parsed(key, s_dict, df):
+    """A function that writes a parsed filing to the cache.
+    The submission is stored as JSON, the info table as a feather file. Both are
+    written to temporary files first and renamed, so readers never see partial
+    entries. Evicts old entries if the cache grows beyond config.parse_cache_max_mb.
+
+    Args:
+        key (str): The cache key (see file_hash()).
+        s_dict (dict): The processed submission (see process_submission()).
+        df (pd.DataFrame): The processed info table (see process_infotable()).
+
+    Returns:
+        Nothing.
+
+    """
+
+    global _cache_bytes
+
+    pathlib.Path(parse_cache_path).mkdir(parents=True, exist_ok=True)
+    s_path, i_path = _entry_paths(key)
+    size = _cache_size()
+
+    with open(f"{s_path}.tmp", "w") as f:
+        json.dump(
+            {k: v.isoformat() if isinstance(v, dt) else v for k, v in s_dict.items()},
+            f,
+        )
+    df.reset_index(drop=True).to_feather(f"{i_path}.tmp")
+
+    for path in [s_path, i_path]:
+        os.replace(f"{path}.tmp", path)
+        size += os.path.getsize(path)
+
+    _cache_bytes = size
+    if _cache_bytes > config.parse_cache_max_mb * 1024 ** 2:
+        evict()
+
+
+def evict(max_bytes=None):
+    """A function that drops the least recently used cache entries until the cache
+    fits into max_bytes. An entry's submission and info table are evicted together
+    and an entry is as recent as the newer of its two files. Entries are evicted
+    down to 90% of the limit, so the directory isn't scanned again on every
+    following store.
+
+    Args:
+        max_bytes (int): The maximum cache size. Defaults to config.parse_cache_max_mb.
+
+    Returns:
+        Nothing.
+
+    """
+
+    global _cache_bytes
+
+    if max_bytes is None:
+        max_bytes = config.parse_cache_max_mb * 1024 ** 2
+
+    entries = {}
+    try:
+        for e in os.scandir(parse_cache_path):
+            key = e.name.split(".")[0]
+            mtime, entry_size, paths = entries.get(key, (0, 0, []))
+            entries[key] = (
+                max(mtime, e.stat().st_mtime),
+                entry_size + e.stat().st_size,
+                paths + [e.path],
+            )
+    except FileNotFoundError:
+        _cache_bytes = 0
+        return
+
+    size = sum(e[1] for e in entries.values())
+    for _, entry_size, paths in sorted(entries.values()):
+        if size <= max_bytes * 0.9:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        size -= entry_size
+
+    _cache_bytes = size
+
+
+def parse_nc(filename, use_cache=True):
+    """A function that reads and processes a .nc file, using the parse cache.
+    Cache entries are keyed by the file's content hash (and the cache version), so
+    a file is only parsed once no matter where it's stored or how often it's
+    loaded into a database.
+
+    Args:
+        filename (str): The absolute filepath.
+        use_cache (bool): Bypasses the cache if False.
+
+    Returns:
+        tuple(dict, pd.DataFrame): The processed submission (see process_submission())
+            and info table without filing_id (see process_infotable()).
+
+    """
+
+    if use_cache:
+        key = f"v{cache_version}-{file_hash(filename)}"
+        cached = load_parsed(key)
+        if cached is not None:
+            return cached
+
+    s, i = read_nc(filename)
+    s_dict = process_submission(s)
+    df = process_infotable(i)
+
+    if use_cache:
+        store_parsed(key, s_dict, df)
+
+    return (s_dict, df)
@@ -0,0 +1,324 @@
+import pathlib
+import re
+import sqlite3
+from datetime import date as dt_date
+from datetime import datetime as dt
+
+import pandas as pd
+import requests
+
+from onethreef.constants import catalog_path, headers, index_url
+
+line_regex = re.compile(
+    r"^(?P<form>.+?)\s{2,}(?P<company>.+?)\s+(?P<cik>\d+)\s+"
+    r"(?P<date>\d{4}-\d{2}-\d{2})\s+(?P<path>edgar/\S+?(?P<accnumber>\d+-\d+-\d+)\.txt)\s*$"
+)
+
+
+def connect_catalog(path=catalog_path):
+    """A function that opens the local SQLite catalog of EDGAR's form.idx files
+    and creates its directory and relations if they don't exist yet.
+
+    'filing_index' holds one row per filer and filing with all columns of form.idx,
+    indexed by cik, form type, date and acc number. 'quarter_loaded' records which
+    quarters are in the catalog and whether they were complete when they were loaded.
+
+    Args:
+        path (str): The filepath of the SQLite database.
+
+    Returns:
+        sqlite3.Connection: The SQLite connection.
+
+    """
+
+    pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        PRAGMA journal_mode = WAL;
+        CREATE TABLE IF NOT EXISTS filing_index (
+            accnumber TEXT NOT NULL,
+            cik INTEGER NOT NULL,
+            company TEXT,
+            form TEXT,
+            date TEXT,
+            path TEXT,
+            year INTEGER,
+            quarter INTEGER,
+            PRIMARY KEY (accnumber, cik)
+        );
+        CREATE INDEX IF NOT EXISTS filing_index_cik ON filing_index (cik, date);
+        CREATE INDEX IF NOT EXISTS filing_index_form ON filing_index (form, date);
+        CREATE INDEX IF NOT EXISTS filing_index_date ON filing_index (date);
+        CREATE INDEX IF NOT EXISTS filing_index_quarter ON filing_index (year, quarter, form);
+        CREATE TABLE IF NOT EXISTS quarter_loaded (
+            year INTEGER,
+            quarter INTEGER,
+            rows INTEGER,
+            complete INTEGER,
+            loaded_at TEXT,
+            PRIMARY KEY (year, quarter)
+        );
+        """
+    )
+
+    return conn
+
+
+def parse_index_lines(lines, year, quarter):
+    """A generator that parses the lines of a form.idx file one by one.
+    Header lines and lines that don't match the form.idx layout are skipped.
+
+    Args:
+        lines (iterable): The lines of a form.idx file.
+        year (int): The year of the index.
+        quarter (int): The quarter of the index.
+
+    Yields:
+        tuple: (acc number, cik, company, form, date, path, year, quarter).
+
+    """
+
+    for line in lines:
+        m = line_regex.match(line)
+        if m is not None:
+            yield (
+                m["accnumber"],
+                int(m["cik"]),
+                m["company"].strip(),
+                m["form"].strip(),
+                m["date"],
+                m["path"],
+                year,
+                quarter,
+            )
+
+
+def _quarter_complete(year, quarter):
+    """Helper function that checks whether a quarter is over, i.e. its form.idx
+    won't change anymore.
+
+    """
+
+    return (int(year), int(quarter)) < (
+        dt_date.today().year,
+        (dt_date.today().month - 1) // 3 + 1,
+    )
+
+
+def update_quarter(conn, year, quarter, refresh=False, index_file=None):
+    """A function that adds a quarter's form.idx to the catalog.
+    Completed quarters are only loaded once unless refresh is True. The running
+    quarter is loaded again on every call to pick up new filings. The index is
+    streamed line by line into the catalog, so it's never held in memory as a whole.
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        year (int): The year.
+        quarter (int): The quarter.
+        refresh (bool): Loads the quarter again even if it's already complete.
+        index_file (str): Reads this local form.idx instead of requesting EDGAR if set.
+
+    Returns:
+        int: The number of rows read from the index, None if the quarter was skipped.
+
+    """
+
+    year, quarter = int(year), int(quarter)
+    loaded = conn.execute(
+        "SELECT complete FROM quarter_loaded WHERE year = ? AND quarter = ?",
+        (year, quarter),
+    ).fetchone()
+    if loaded is not None and loaded[0] and not refresh:
+        return None
+
+    if index_file is None:
+        req = requests.get(
+            index_url.format(year=year, quarter=quarter), headers=headers, stream=True
+        )
+        req.raise_for_status()
+        req.encoding = req.encoding or "latin-1"
+        lines = req.iter_lines(decode_unicode=True)
+    else:
+        lines = open(index_file, "r", encoding="latin-1")
+
+    try:
+        with conn:
+            rows = conn.execute("SELECT total_changes()").fetchone()[0]
+            conn.executemany(
+                "INSERT OR REPLACE INTO filing_index VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                parse_index_lines(lines, year, quarter),
+            )
+            rows = conn.execute("SELECT total_changes()").fetchone()[0] - rows
+            conn.execute(
+                "INSERT OR REPLACE INTO quarter_loaded VALUES (?, ?, ?, ?, ?)",
+                (
+                    year,
+                    quarter,
+                    rows,
+                    _quarter_complete(year, quarter),
+                    dt.now().isoformat(),
+                ),
+            )
+    finally:
+        lines.close()
+
+    return rows
+
+
+def update_catalog(conn, start_year=1993, end_year=None, refresh=False):
+    """A function that adds all quarters from start_year to end_year to the catalog.
+    Quarters that are already complete in the catalog are skipped, so running it
+    again only fetches the running quarter.
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        start_year (int): The first year (EDGAR's full index starts in 1993).
+        end_year (int): The last year. Defaults to the current year.
+        refresh (bool): Loads complete quarters again if True.
+
+    Returns:
+        dict: The number of rows read per (year, quarter) that was loaded.
+
+    """
+
+    today = dt_date.today()
+    end_year = today.year if end_year is None else int(end_year)
+    updated = {}
+
+    for year in range(int(start_year), end_year + 1):
+        for quarter in range(1, 5):
+            if (year, quarter) > (today.year, (today.month - 1) // 3 + 1):
+                break
+            rows = update_quarter(conn, year, quarter, refresh=refresh)
+            if rows is not None:
+                updated[(year, quarter)] = rows
+
+    return updated
+
+
+def _where(cik=None, form_type=None, start=None, end=None, year=None, quarter=None):
+    """Helper function that builds a WHERE clause and its parameters from filters."""
+
+    clauses, params = [], []
+    if cik is not None:
+        clauses.append("cik = ?")
+        params.append(int(cik))
+    if form_type is not None:
+        form_type = [form_type] if isinstance(form_type, str) else list(form_type)
+        clauses.append(f"form IN ({','.join('?' * len(form_type))})")
+        params.extend(form_type)
+    if start is not None:
+        clauses.append("date >= ?")
+        params.append(str(start))
+    if end is not None:
+        clauses.append("date <= ?")
+        params.append(str(end))
+    if year is not None:
+        clauses.append("year = ?")
+        params.append(int(year))
+    if quarter is not None:
+        clauses.append("quarter = ?")
+        params.append(int(quarter))
+
+    return (" WHERE " + " AND ".join(clauses) if clauses else "", params)
+
+
+def query_catalog(conn, **filters):
+    """A function that returns all catalog rows matching the filters.
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        **filters: Any of cik, form_type (str or list), start and end (dates as
+            YYYY-MM-DD), year and quarter.
+
+    Returns:
+        pd.DataFrame: The matching rows ordered by date.
+
+    """
+
+    where, params = _where(**filters)
+
+    return pd.read_sql_query(
+        f"SELECT * FROM filing_index{where} ORDER BY date, accnumber",
+        conn,
+        params=params,
+    )
+
+
+def count_filings(conn, **filters):
+    """A function that counts the catalog rows matching the filters
+    (e.g. count_filings(conn, form_type="13F-HR/A", year=2019)).
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        **filters: The filters (see query_catalog()).
+
+    Returns:
+        int: The number of matching rows.
+
+    """
+
+    where, params = _where(**filters)
+
+    return conn.execute(f"SELECT COUNT(*) FROM filing_index{where}", params).fetchone()[
+        0
+    ]
+
+
+def filer_quarters(conn, cik, form_type=["13F-HR", "13F-HR/A"]):
+    """A function that returns the quarters in which a company filed.
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        cik (str): A unique company identifier (e.g. 0001162781).
+        form_type (list): A list of SEC form types to consider.
+
+    Returns:
+        list: A sorted list of tuples (year, quarter).
+
+    """
+
+    where, params = _where(cik=cik, form_type=form_type)
+
+    return conn.execute(
+        f"SELECT DISTINCT year, quarter FROM filing_index{where} ORDER BY year, quarter",
+        params,
+    ).fetchall()
+
+
+def filing_paths(conn, year, quarter, form_type=["13F-HR", "13F-HR/A"]):
+    """A function that returns the location of every filing of a quarter that matches
+    the specified form_type, the catalog equivalent of fetch_filing_paths().
+
+    Args:
+        conn (sqlite3.Connection): The SQLite connection (see connect_catalog()).
+        year (int): The year.
+        quarter (int): The quarter.
+        form_type (list): A list of SEC form types to extract (e.g. 13F-HR, 10K)
+
+    Returns:
+        list: A list of tuples (date, acc number, path) (see parse_index()) or None
+            if the quarter isn't in the catalog or wasn't complete when it was
+            loaded, i.e. the catalog may miss some of its filings.
+
+    """
+
+    loaded = conn.execute(
+        "SELECT complete FROM quarter_loaded WHERE year = ? AND quarter = ?",
+        (int(year), int(quarter)),
+    ).fetchone()
+    if loaded is None or not loaded[0]:
+        return None
+
+    where, params = _where(form_type=form_type, year=year, quarter=quarter)
+
+    return conn.execute(
+        f"""
+        SELECT replace(MIN(date), '-', ''), accnumber, MIN(path)
+        FROM filing_index{where}
+        GROUP BY accnumber
+        ORDER BY MIN(date), accnumber
+        """,
+        params,
+    ).fetchall()
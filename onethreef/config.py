@@ -5,4 +5,5 @@ postgres_user = "your_postgres_user"
 postgres_pwd = "your_postgres_pwd"
 postgres_ip = "your_postgres_ip"
 postgres_port = "your_postgres_port"
-postgres_db = "your_postgres_db"
\ No newline at end of file
+postgres_db = "your_postgres_db"
+parse_cache_max_mb = 2048
@@ -12,7 +12,13 @@ headers = {
     "Host": "www.sec.gov",
 }
 index_url = "https://www.sec.gov/Archives/edgar/full-index/{year}/QTR{quarter}/form.idx"
+archives_url = "https://www.sec.gov/Archives/{path}"
+daily_index_url = (
+    "https://www.sec.gov/Archives/edgar/daily-index/{year}/QTR{quarter}/form.{date}.idx"
+)
 storage_path = Path(config.storage_path)
+parse_cache_path = storage_path / ".parse_cache"
+catalog_path = storage_path / "catalog.sqlite"
 ns = {
     "": "http://www.sec.gov/edgar/thirteenffiler",
     "com": "http://www.sec.gov/edgar/common",
@@ -37,16 +43,15 @@ empty_df = pd.DataFrame(
 )
 
 
+postgres_url = f"postgresql://{config.postgres_user}:{config.postgres_pwd}@{config.postgres_ip}:{config.postgres_port}/{config.postgres_db}"
+
+
 def _create_engine():
     """A helper function that creates a SQLAlchemy engine. Used for SQLModels."""
 
-    return create_engine(
-        f"postgresql://{config.postgres_user}:{config.postgres_pwd}@{config.postgres_ip}:{config.postgres_port}/{config.postgres_db}"
-    )
+    return create_engine(postgres_url)
 
 
 def _init_connection():
     """A helper function to make a psycopg2 connection to the database."""
-    return psycopg2.connect(
-        f"postgresql://{config.postgres_user}:{config.postgres_pwd}@{config.postgres_ip}:{config.postgres_port}/{config.postgres_db}"
-    )
+    return psycopg2.connect(postgres_url)
@@ -0,0 +1,367 @@
+import pandas as pd
+
+from onethreef.constants import empty_df
+from onethreef.write import add_portfolio, run_query
+
+portfolio_columns = list(empty_df.columns)
+key_columns = [
+    "cusip",
+    "titleofclass",
+    "putcall",
+    "investmentdiscretion",
+    "othermanager",
+]
+numeric_columns = ["value", "sshprnamt", "sole", "shared", "nonne"]
+text_columns = [
+    "nameofissuer",
+    "titleofclass",
+    "cusip",
+    "sshprnamttype",
+    "investmentdiscretion",
+    "putcall",
+    "othermanager",
+]
+keyframe_interval = 8
+
+
+def create_delta_tables(conn):
+    """Database query to create the 'delta_filing' relation if it doesn't exist yet.
+    It holds one row per filing in compact storage: the filing's cik, its position
+    seq in the filer's chain of compact filings, whether it's stored in full
+    (keyframe) or as a delta to the previous filing of the chain and its number of
+    stored rows.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        Nothing.
+
+    """
+
+    q = """
+    CREATE TABLE IF NOT EXISTS delta_filing (
+        filing_id BIGINT PRIMARY KEY REFERENCES filing(filing_id),
+        cik VARCHAR,
+        seq INTEGER,
+        keyframe BOOLEAN,
+        stored_rows INTEGER,
+        UNIQUE (cik, seq)
+    );
+    """
+    with conn.cursor() as cur:
+        cur.execute(q)
+    conn.commit()
+
+
+def create_delta_table(conn, cik):
+    """Database query to create a company's compact portfolio relation 'd{cik}'.
+    Has the columns of the portfolio relation (see create_portfolio_table()) plus
+    the position_key (see position_keys()) and op: K for a keyframe's positions,
+    A for added, C for changed and R for removed positions of a delta. Removed
+    positions only hold their key columns.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): A unique company identifier (e.g. 0001162781).
+
+    Returns:
+        Nothing.
+
+    """
+
+    q = """
+    SELECT pg_advisory_xact_lock(hashtext('d{0}'));
+    CREATE TABLE IF NOT EXISTS d{0} (
+        portfolio_id INTEGER,
+        nameofissuer VARCHAR,
+        titleofclass VARCHAR,
+        cusip VARCHAR,
+        value BIGINT,
+        sshprnamt BIGINT,
+        sshprnamttype VARCHAR,
+        investmentdiscretion VARCHAR,
+        sole BIGINT,
+        shared BIGINT,
+        nonne BIGINT,
+        putcall VARCHAR,
+        othermanager VARCHAR,
+        filing_id BIGINT,
+        position_key VARCHAR,
+        op CHAR(1),
+        PRIMARY KEY (filing_id,position_key),
+        FOREIGN KEY (filing_id) REFERENCES filing(filing_id)
+    );
+    """
+    with conn.cursor() as cur:
+        cur.execute(q.format(cik))
+    conn.commit()
+
+
+def check_compact_portfolio_exists(conn, filing_id):
+    """Database query to check if a filing is already in compact storage.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        filing_id (int): The filing's filing_id.
+
+    Returns:
+        False if the filing isn't stored (or there is no compact storage yet), True if it is
+
+    """
+
+    if run_query(conn, "SELECT to_regclass('delta_filing')")[0][0] is None:
+        return False
+
+    q = f"SELECT EXISTS(SELECT * FROM delta_filing WHERE filing_id = {int(filing_id)})"
+
+    return run_query(conn, q)[0][0]
+
+
+def position_keys(df):
+    """A function that identifies the positions of an info table across filings.
+    A position is identified by its cusip, title of class, put/call, investment
+    discretion and other managers. Positions that share all of those get an
+    ordinal suffix in the order of the info table.
+
+    Args:
+        df (pd.DataFrame): A preprocessed info table (see process_infotable()).
+
+    Returns:
+        pd.Series: The position keys (e.g. 037833100|COM||SOLE||0).
+
+    """
+
+    keys = df[key_columns[0]].fillna("").astype(str)
+    for col in key_columns[1:]:
+        keys = keys + "|" + df[col].fillna("").astype(str)
+
+    return keys + "|" + keys.groupby(keys).cumcount().astype(str)
+
+
+def _changed(prev, cur):
+    """Helper function that flags the positions whose values differ between two
+    info tables with the same index. portfolio_id isn't compared, so positions that
+    only moved within the info table aren't stored again.
+
+    """
+
+    changed = pd.Series(False, index=cur.index)
+    for col in numeric_columns:
+        a = pd.to_numeric(prev[col], errors="coerce")
+        b = pd.to_numeric(cur[col], errors="coerce")
+        changed |= (a != b) & ~(a.isna() & b.isna())
+    for col in text_columns:
+        changed |= prev[col].fillna("").astype(str) != cur[col].fillna("").astype(str)
+
+    return changed
+
+
+def diff_portfolio(prev, df):
+    """A function that encodes an info table as a delta to the previous one.
+
+    Args:
+        prev (pd.DataFrame): The previous portfolio including position_key
+            (see reconstruct_portfolio()).
+        df (pd.DataFrame): The preprocessed info table including position_key.
+
+    Returns:
+        pd.DataFrame: The added (A), changed (C) and removed (R) positions with
+            the columns of the compact portfolio relation except filing_id.
+
+    """
+
+    prev = prev.set_index("position_key")
+    df = df.set_index("position_key")
+    common = df.index.intersection(prev.index)
+
+    added = df.loc[df.index.difference(prev.index)].assign(op="A")
+    changed = df.loc[common]
+    changed = changed[_changed(prev.loc[common], changed)].assign(op="C")
+    removed = (
+        prev.loc[prev.index.difference(df.index), key_columns]
+        .reindex(columns=[c for c in portfolio_columns if c != "filing_id"])
+        .assign(op="R")
+    )
+
+    return (
+        pd.concat([added, changed, removed]).rename_axis("position_key").reset_index()
+    )
+
+
+def _chain_head(conn, cik):
+    """Helper function that returns the filing_id, seq and last keyframe seq of a
+    filer's latest compact filing or None if the filer has none.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT filing_id, seq,
+            (SELECT MAX(seq) FROM delta_filing WHERE cik = %(cik)s AND keyframe)
+            FROM delta_filing
+            WHERE cik = %(cik)s
+            ORDER BY seq DESC
+            LIMIT 1
+            """,
+            {"cik": cik},
+        )
+        return cur.fetchone()
+
+
+def add_compact_portfolio(
+    conn, df, cik, filing_id, keyframe_interval=keyframe_interval, commit=True
+):
+    """A function that writes a filing's info table to compact storage.
+    The first filing of a filer and every keyframe_interval-th filing after the last
+    keyframe are stored in full. All other filings are stored as a delta to the
+    filer's previous compact filing (see diff_portfolio()), unless the delta isn't
+    smaller than the filing itself. The whole write is a single transaction, which
+    holds an advisory lock on the filer's chain until it's committed.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        df (pd.DataFrame): The preprocessed info table.
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (int): The filing's filing_id.
+        keyframe_interval (int): The maximum number of filings between two keyframes.
+        commit (bool): Commits the write if True. Used to write a filing's
+            positions and rollups in a single transaction.
+
+    Returns:
+        bool: True if the filing was stored as a keyframe.
+
+    """
+
+    df = df.assign(position_key=position_keys(df))
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"delta{cik}",))
+    head = _chain_head(conn, cik)
+
+    if head is None:
+        seq, keyframe = 0, True
+    else:
+        seq = head[1] + 1
+        keyframe = seq - head[2] >= keyframe_interval
+        if not keyframe:
+            delta = diff_portfolio(
+                _reconstruct(conn, cik, head[0]).drop(columns="filing_id"), df
+            )
+            keyframe = len(delta) >= len(df)
+
+    rows = df.assign(op="K") if keyframe else delta
+    rows = rows.assign(filing_id=filing_id)[portfolio_columns + ["position_key", "op"]]
+    rows = rows.astype({c: "Int64" for c in ["portfolio_id"] + numeric_columns})
+    rows = rows.astype(object).where(rows.notna(), None)
+
+    try:
+        if len(rows) > 0:
+            add_portfolio(conn, rows, f"d{cik}", commit=False)
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO delta_filing VALUES (%s, %s, %s, %s, %s)",
+                (int(filing_id), cik, seq, keyframe, len(rows)),
+            )
+        if commit:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return keyframe
+
+
+def reconstruct_query(cik, filing_id="%(filing_id)s", cik_sql="%(cik)s"):
+    """A function that builds the query reconstructing a compact filing.
+    Reads the rows from the filing's closest keyframe up to the filing itself and
+    keeps the latest row per position unless it's a removal, all in one query.
+    Positions carried over from earlier filings keep the portfolio_id they had
+    there, so the positions are renumbered in their reconstructed order.
+
+    Args:
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (str): A SQL expression for the filing's filing_id. Defaults to
+            the query parameter filing_id.
+        cik_sql (str): A SQL expression for the cik. Defaults to the query
+            parameter cik.
+
+    Returns:
+        str: The query. Selects the columns of the portfolio relation followed by
+            position_key.
+
+    """
+
+    cols = ",".join(f"p.{c}" for c in portfolio_columns[1:-1])
+    seq = f"(SELECT t.seq FROM delta_filing t WHERE t.filing_id = {filing_id})"
+
+    return f"""
+    SELECT
+    (row_number() OVER (ORDER BY p.portfolio_id, p.position_key) - 1)::INTEGER AS portfolio_id,
+    {cols}, {filing_id}::BIGINT AS filing_id, p.position_key
+    FROM (
+        SELECT DISTINCT ON (d.position_key) d.*
+        FROM d{cik} d JOIN delta_filing f USING (filing_id)
+        WHERE
+        f.cik = {cik_sql}
+        AND f.seq BETWEEN (
+            SELECT MAX(k.seq)
+            FROM delta_filing k
+            WHERE k.cik = {cik_sql} AND k.keyframe AND k.seq <= {seq}
+        ) AND {seq}
+        ORDER BY d.position_key, f.seq DESC
+    ) p
+    WHERE p.op <> 'R'
+    ORDER BY 1
+    """
+
+
+def _reconstruct(conn, cik, filing_id):
+    """Helper function that reconstructs a compact filing including position_key."""
+
+    with conn.cursor() as cur:
+        cur.execute(reconstruct_query(cik), {"cik": cik, "filing_id": int(filing_id)})
+        return pd.DataFrame(
+            cur.fetchall(), columns=portfolio_columns + ["position_key"]
+        )
+
+
+def reconstruct_portfolio(conn, cik, filing_id=None, date=None):
+    """Database query that reconstructs a filer's portfolio from compact storage.
+    Selects the given filing, otherwise the latest compact filing whose period of
+    report isn't after date, otherwise the latest compact filing (see
+    reconstruct_query()).
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (int): The filing's filing_id.
+        date (datetime.datetime or str): The point in time (e.g. 2015-12-31).
+
+    Returns:
+        pd.DataFrame: The positions with the columns of the portfolio relation,
+            None if there is no matching compact filing.
+
+    """
+
+    if filing_id is None:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT d.filing_id
+                FROM delta_filing d JOIN filing f USING (filing_id)
+                WHERE d.cik = %s AND (%s::timestamp IS NULL OR f.periodofreport <= %s::timestamp)
+                ORDER BY f.periodofreport DESC, f.filing_id DESC
+                LIMIT 1
+                """,
+                (cik, date, date),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        filing_id = row[0]
+    elif not check_compact_portfolio_exists(conn, filing_id):
+        return None
+
+    return _reconstruct(conn, cik, filing_id).drop(columns="position_key")
@@ -9,7 +9,8 @@ import aiohttp
 import requests
 from tqdm import tqdm
 
-from onethreef.constants import headers, index_url, storage_path
+from onethreef.constants import archives_url, headers, index_url, storage_path
+from onethreef.read import existing_ncs
 
 
 def fetch_index(year, quarter, form_type=["13F-HR", "13F-HR/A"]):
@@ -45,6 +46,58 @@ def fetch_index(year, quarter, form_type=["13F-HR", "13F-HR/A"]):
         return (dates, accnos)
 
 
+def parse_index(text, form_type=["13F-HR", "13F-HR/A"]):
+    """A function that extracts filings of the specified form_type from a form.idx file.
+    Works for the quarterly form.idx (dates like 2013-02-14) as well as the daily
+    form index (dates like 20130214). The date is read from the column right before
+    the path, so it's never taken from the acc number.
+
+    Args:
+        text (str): The content of a form.idx file.
+        form_type (list): A list of SEC form types to extract (e.g. 13F-HR, 10K)
+
+    Returns:
+        list: A list of tuples (date, acc number, path) where path is the filing's
+            location relative to https://www.sec.gov/Archives/.
+
+    """
+
+    line_regex = re.compile(
+        r"\s(?P<date>\d{4}-\d{2}-\d{2}|\d{8})\s+"
+        r"(?P<path>edgar/data/\d+/(?P<accnumber>\d+-\d+-\d+)\.txt)\s*$"
+    )
+    filings = []
+    for line in text.split("\n"):
+        if line.startswith(tuple(form_type)):
+            m = line_regex.search(line)
+            if m is not None:
+                filings.append((m["date"].replace("-", ""), m["accnumber"], m["path"]))
+
+    return filings
+
+
+def fetch_filing_paths(year, quarter, form_type=["13F-HR", "13F-HR/A"]):
+    """A function that fetches a form.idx file from SEC EDGAR and returns the
+    location of every filing that matches the specified form_type. Raises
+    requests.HTTPError if EDGAR doesn't return the file (e.g. the quarter hasn't
+    started yet or the request was throttled).
+
+    Args:
+        year (int): The year.
+        quarter (int): The quarter.
+        form_type (list): A list of SEC form types to extract (e.g. 13F-HR, 10K)
+
+    Returns:
+        list: A list of tuples (date, acc number, path) (see parse_index()).
+
+    """
+
+    req = requests.get(index_url.format(year=year, quarter=quarter), headers=headers)
+    req.raise_for_status()
+
+    return parse_index(req.text, form_type=form_type)
+
+
 def existing_feeds(year, quarter):
     """A helper function to list all downloaded feeds of a quarter.
 
@@ -145,6 +198,88 @@ async def download_feeds(year, quarter, dates=[], MAX_TASKS=5):
     await asyncio.gather(*tasks)
 
 
+async def download_filing(session, url, path, sem, min_duration=0):
+    """A function that downloads a single filing's submission file.
+    The file is written to a temporary file and renamed once complete, so an
+    interrupted download never leaves a partial .nc file behind.
+
+    Args:
+        session (aiohttp.ClientSession): The shared client session.
+        url (str): The filing url.
+        path (str): The filepath to write the filing to.
+        sem (asyncio.locks.Semaphore): The semaphore lock to restrict maximum number of
+            downloads at the same time.
+        min_duration (float): The minimum number of seconds to hold the semaphore.
+            Used to throttle the request rate.
+
+    Returns:
+        Nothing.
+
+    """
+
+    async with sem:
+        started = asyncio.get_event_loop().time()
+        async with session.get(url, headers=headers) as response:
+            response.raise_for_status()
+            async with aiofiles.open(f"{path}.part", "wb") as f:
+                async for chunk in response.content.iter_chunked(65536):
+                    await f.write(chunk)
+        os.replace(f"{path}.part", path)
+
+        elapsed = asyncio.get_event_loop().time() - started
+        await asyncio.sleep(max(0, min_duration - elapsed))
+
+
+async def download_filings(year, quarter, filings, MAX_TASKS=10, MAX_RATE=10):
+    """A function that downloads individual filings instead of entire daily feeds.
+    Each filing's submission file is fetched from the EDGAR archives and stored as
+    {acc number}.nc in the quarter directory, the same layout extract_feed() produces.
+    Filings that already exist are skipped. Every download holds its semaphore slot
+    for at least MAX_TASKS / MAX_RATE seconds, which keeps the total request rate
+    below MAX_RATE (the SEC allows 10 requests per second).
+
+    Args:
+        year (int): The year.
+        quarter (int): The quarter.
+        filings (list): A list of tuples (date, acc number, path) (see fetch_filing_paths()).
+        MAX_TASKS (int): The maximum number of filings to download at the same time.
+        MAX_RATE (int): The maximum number of requests per second.
+
+    Returns:
+        list: The acc numbers of the filings that failed to download.
+
+    """
+
+    directory = os.path.join(storage_path, str(year), f"QTR{quarter}")
+    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+    existing = set(existing_ncs(year, quarter, absolute=False))
+    filings = [f for f in filings if f"{f[1]}.nc" not in existing]
+
+    sem = asyncio.Semaphore(MAX_TASKS)
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(
+            *[
+                download_filing(
+                    session,
+                    archives_url.format(path=path),
+                    os.path.join(directory, f"{accno}.nc"),
+                    sem,
+                    min_duration=MAX_TASKS / MAX_RATE,
+                )
+                for date, accno, path in filings
+            ],
+            return_exceptions=True,
+        )
+
+    failed = []
+    for (date, accno, path), result in zip(filings, results):
+        if isinstance(result, Exception):
+            print("failed", accno, repr(result))
+            failed.append(accno)
+
+    return failed
+
+
 def extract_feed(filename, files_to_extract=[]):
     """A function that extracts a list of acc numbers from a feed.
     This is used to reduce the file size on disk. Feeds are large since they contain
@@ -0,0 +1,318 @@
+import json
+import os
+import traceback
+from datetime import datetime as dt
+
+from sqlalchemy import text
+from sqlmodel import Session
+from tqdm import tqdm
+
+from onethreef import delta, rollup
+from onethreef.cache import parse_nc
+from onethreef.constants import _create_engine, _init_connection, empty_df
+from onethreef.read import stream_nc
+from onethreef.write import (
+    add_company,
+    add_filing,
+    add_portfolio,
+    check_company_exists,
+    check_filing_exists,
+    check_filing_portfolio_exists,
+    check_portfolio_exists,
+    create_portfolio_table,
+    notify_filing,
+)
+
+dead_letter_file = "failed.jsonl"
+stream_row_bytes = 4096
+
+
+def nc_accnumber(filename):
+    """A helper function that returns the acc number of a .nc file.
+
+    Args:
+        filename (str): The filename or absolute filepath (e.g. .../0001162781-22-000001.nc).
+
+    Returns:
+        str: The acc number (e.g. 0001162781-22-000001).
+
+    """
+
+    return os.path.basename(filename)[: -len(".nc")]
+
+
+def chunk_rows_for(max_memory_mb):
+    """A helper function that converts a memory ceiling into a chunk size for
+    streaming loads (see stream_nc()).
+
+    Args:
+        max_memory_mb (int): The maximum memory for a filing's buffered rows in MB.
+
+    Returns:
+        int: The number of rows per chunk.
+
+    """
+
+    return max(1, int(max_memory_mb * 1024 ** 2 // stream_row_bytes))
+
+
+def _add_portfolio_chunks(conn, chunks, table, filing_id):
+    """Helper function that inserts a filing's info table chunks without committing
+    and returns the filing's per cusip totals for the rollups. If any chunk fails
+    (e.g. a malformed or truncated info table), the chunks inserted so far are
+    rolled back, so a filing is never left partially stored.
+
+    """
+
+    totals = rollup.security_totals(empty_df)
+    try:
+        for df in chunks:
+            df = df.assign(filing_id=filing_id)
+            add_portfolio(conn, df, table, commit=False)
+            totals = totals.add(rollup.security_totals(df), fill_value=0)
+    except Exception:
+        conn.rollback()
+        raise
+
+    return totals
+
+
+def load_filing(sess, conn, nc, use_cache=True, chunk_rows=None, compact=False):
+    """A function that writes a single .nc file to the database.
+    Adds the company and filing if they don't have a record yet, creates the
+    company's portfolio relation if it doesn't exist and inserts the filing's
+    positions and rollups in a single transaction unless they're already stored.
+    Loading the same file twice is therefore a no-op. Stored positions that are
+    missing from the rollups (e.g. after a crash) are added to them.
+
+    If chunk_rows is set, the info table is streamed from the file (see stream_nc())
+    and written chunk by chunk, so at most chunk_rows positions are held in memory.
+    Streamed filings bypass the parse cache.
+
+    If compact is True, the positions are written to the company's compact
+    portfolio relation instead, in full or as a delta to the company's previous
+    compact filing (see add_compact_portfolio()). Deltas are computed on the whole
+    info table, so chunk_rows is ignored in compact mode.
+
+    Args:
+        sess (sqlmodel.orm.session.Session): A SQLModel session.
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        nc (str): The absolute filepath of the .nc file.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        chunk_rows (int): Streams the info table in chunks of this many rows if set.
+        compact (bool): Writes the positions to compact storage if True.
+
+    Returns:
+        int: The filing_id.
+
+    """
+
+    if chunk_rows is None or compact:
+        s_dict, df = parse_nc(nc, use_cache=use_cache)
+    else:
+        s_dict, chunks = stream_nc(nc, chunk_rows=chunk_rows)
+    accnumber = nc_accnumber(nc)
+
+    # Company, locked so concurrent loaders don't add the same company twice
+    sess.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext(:key))").bindparams(
+            key=f"company{s_dict['cik']}"
+        )
+    )
+    company_id = check_company_exists(sess, s_dict["cik"])
+    if company_id is None:
+        add_company(sess, s_dict)
+        company_id = check_company_exists(sess, s_dict["cik"])
+
+    # Filing
+    filing_id = check_filing_exists(sess, accnumber)
+    if filing_id is None:
+        add_filing(sess, s_dict, company_id=company_id, accnumber=accnumber)
+        filing_id = check_filing_exists(sess, accnumber)
+
+    sess.commit()
+
+    # A filing's positions are only stored once, either in its company's portfolio
+    # relation or in compact storage
+    stored = delta.check_compact_portfolio_exists(conn, filing_id)
+    if not stored and check_portfolio_exists(conn, s_dict["cik"]):
+        stored = check_filing_portfolio_exists(conn, s_dict["cik"], filing_id)
+
+    if stored:
+        # Repairs the rollups of positions that were stored without them
+        if not rollup.check_rollup_exists(conn, filing_id):
+            rollup.update_rollups(
+                conn,
+                rollup.stored_totals(conn, s_dict["cik"], filing_id),
+                s_dict["cik"],
+                filing_id,
+                s_dict["periodOfReport"],
+                amendmenttype=s_dict.get("amendmentType"),
+            )
+        return filing_id
+
+    # Positions, committed together with the rollups by update_rollups()
+    if compact:
+        delta.create_delta_table(conn, s_dict["cik"])
+        delta.add_compact_portfolio(conn, df, s_dict["cik"], filing_id, commit=False)
+        totals = rollup.security_totals(df)
+    else:
+        if not check_portfolio_exists(conn, s_dict["cik"]):
+            create_portfolio_table(conn, s_dict["cik"])
+        if chunk_rows is None:
+            df = df.assign(filing_id=filing_id)
+            add_portfolio(conn, df, f"c{s_dict['cik']}", commit=False)
+            totals = rollup.security_totals(df)
+        else:
+            totals = _add_portfolio_chunks(conn, chunks, f"c{s_dict['cik']}", filing_id)
+
+    rollup.update_rollups(
+        conn,
+        totals,
+        s_dict["cik"],
+        filing_id,
+        s_dict["periodOfReport"],
+        amendmenttype=s_dict.get("amendmentType"),
+    )
+    notify_filing(conn, s_dict["cik"], accnumber, compact=compact)
+
+    return filing_id
+
+
+def record_failure(nc, error):
+    """A function that appends a failed filing to the dead letter file of its directory.
+    Each line of the file is a JSON object with the filing's acc number, filepath,
+    error message, traceback and the time of failure.
+
+    Args:
+        nc (str): The absolute filepath of the .nc file.
+        error (Exception): The exception raised while loading the filing.
+
+    Returns:
+        Nothing.
+
+    """
+
+    record = {
+        "accnumber": nc_accnumber(nc),
+        "filename": nc,
+        "error": repr(error),
+        "traceback": "".join(
+            traceback.format_exception(type(error), error, error.__traceback__)
+        ),
+        "failed_at": dt.now().isoformat(),
+    }
+
+    with open(os.path.join(os.path.dirname(nc), dead_letter_file), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_failures(path):
+    """A function that reads a dead letter file.
+
+    Args:
+        path (str): The absolute filepath of the dead letter file.
+
+    Returns:
+        list: A list of dictionaries, one per failed filing.
+
+    """
+
+    try:
+        with open(path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def load_filings(ncs, batch=False, use_cache=True, chunk_rows=None, compact=False):
+    """A function that writes a list of .nc files to the database.
+    By default the first failing filing aborts the run and its uncommitted writes
+    are rolled back. In batch mode every filing
+    is loaded on its own: a failure rolls back the filing's open transactions,
+    is recorded in the dead letter file next to the filing (see record_failure())
+    and the run continues with the next filing.
+
+    Args:
+        ncs (list): A list of absolute filepaths of .nc files.
+        batch (bool): Isolates failing filings if True.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        chunk_rows (int): Streams info tables in chunks of this many rows if set.
+        compact (bool): Writes the positions to compact storage if True.
+
+    Returns:
+        list: The filepaths of the filings that failed (only in batch mode).
+
+    """
+
+    engine = _create_engine()
+    conn = _init_connection()
+    rollup.create_rollup_tables(conn)
+    if compact:
+        delta.create_delta_tables(conn)
+    failed = []
+
+    try:
+        with Session(engine) as sess:
+            for nc in tqdm(ncs):
+                try:
+                    load_filing(
+                        sess,
+                        conn,
+                        nc,
+                        use_cache=use_cache,
+                        chunk_rows=chunk_rows,
+                        compact=compact,
+                    )
+                except Exception as e:
+                    if not batch:
+                        raise
+                    sess.rollback()
+                    conn.rollback()
+                    record_failure(nc, e)
+                    failed.append(nc)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return failed
+
+
+def retry_failed(directory, use_cache=True, chunk_rows=None, compact=False):
+    """A function that reloads all filings of a directory's dead letter file in batch mode.
+    The dead letter file is moved aside while retrying, so filings that fail again
+    end up in a fresh dead letter file. An interrupted retry is picked up again by
+    the next call.
+
+    Args:
+        directory (str): The absolute path of the directory (e.g. .../2016/QTR1).
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        chunk_rows (int): Streams info tables in chunks of this many rows if set.
+        compact (bool): Writes the positions to compact storage if True.
+
+    Returns:
+        list: The filepaths of the filings that failed again.
+
+    """
+
+    path = os.path.join(directory, dead_letter_file)
+    retrying = f"{path}.retrying"
+
+    if os.path.exists(path):
+        records = read_failures(retrying) + read_failures(path)
+        with open(retrying, "w") as f:
+            f.writelines(json.dumps(r) + "\n" for r in records)
+        os.remove(path)
+
+    ncs = list(dict.fromkeys(r["filename"] for r in read_failures(retrying)))
+    failed = load_filings(
+        ncs, batch=True, use_cache=use_cache, chunk_rows=chunk_rows, compact=compact
+    )
+
+    if os.path.exists(retrying):
+        os.remove(retrying)
+
+    return failed
@@ -8,6 +8,8 @@ import xmltodict
 
 from onethreef.constants import empty_df, storage_path
 
+block_size = 1 << 16
+
 
 def existing_ncs(year, quarter, absolute=True):
     """A function that returns all .nc files of a given year & quarter.
@@ -91,34 +93,165 @@ def read_nc(filename):
     )
 
 
-def process_infotable(infotable, filing_id=None):
-    """A function that processes the raw info table dictionary.
-    The function first checks for edge scenarios such as an empty portfolio or
-    with only one entry. Second, sometimes columns are missing in the info table
-    as they're not part of the filing. The function appends missing columns to keep
-    the database entries consistent. Third, preprocessing. Explode nested columns,
-    rename columns, add portfolio_id, convert str to int (first to float due to
-    formatting issues), convert str to upper str, correctly order the columns.
+def _local_name(tag):
+    """Helper function that strips the namespace of an ElementTree tag."""
+
+    return tag.rsplit("}", 1)[-1]
+
+
+def _element_to_dict(elem):
+    """Helper function that converts an element into the dictionary xmltodict
+    would produce for it (without namespaces and attributes).
+
+    """
+
+    children = list(elem)
+    if len(children) == 0:
+        return elem.text
+
+    return {_local_name(c.tag): _element_to_dict(c) for c in children}
+
+
+def _xml_pieces(f):
+    """Helper generator that reads an open .nc file (in binary mode) in blocks of
+    block_size bytes from its current position and yields the content of the next
+    <XML> section piece by piece. The tags are found across block boundaries, so it
+    doesn't matter how the XML is split into lines. Once the section is read, the
+    file is positioned right after its </XML>.
+
+    """
+
+    buf = b""
+    while True:
+        block = f.read(block_size)
+        buf += block
+        start = buf.find(b"<XML>")
+        if start >= 0:
+            buf = buf[start + len(b"<XML>") :]
+            break
+        if not block:
+            return
+        buf = buf[-len(b"<XML") :]
+
+    while True:
+        end = buf.find(b"</XML>")
+        if end >= 0:
+            if end > 0:
+                yield buf[:end]
+            f.seek(f.tell() - (len(buf) - end - len(b"</XML>")))
+            return
+        if len(buf) > len(b"</XML"):
+            yield buf[: -len(b"</XML")]
+            buf = buf[-len(b"</XML") :]
+        block = f.read(block_size)
+        if not block:
+            if len(buf) > 0:
+                yield buf
+            return
+        buf += block
+
+
+def _iter_infotable(filename, start, chunk_rows):
+    """Helper function that incrementally parses the info table of a .nc file.
+    The file is opened at start (the byte right after the submission) only once the
+    generator is consumed and closed when it's exhausted or closed. Blocks of the
+    info table are fed into a pull parser. Every finished infoTable element is
+    converted into a row and removed from the tree, so only the current chunk of
+    rows is held in memory.
+
+    """
+
+    with open(filename, "rb") as f:
+        f.seek(start)
+        parser = ET.XMLPullParser(events=("start", "end"))
+        root = None
+        rows = []
+        offset = 0
+        started = False
+
+        for piece in _xml_pieces(f):
+            if not started:
+                piece = piece.lstrip()
+                started = len(piece) > 0
+            parser.feed(piece)
+
+            for event, elem in parser.read_events():
+                if event == "start" and root is None:
+                    root = elem
+                elif event == "end" and _local_name(elem.tag) == "infoTable":
+                    row = _element_to_dict(elem)
+                    if isinstance(row, dict):
+                        rows.append(row)
+                    root.clear()
+                    if len(rows) == chunk_rows:
+                        yield normalize_infotable(pd.DataFrame(rows), offset=offset)
+                        offset += len(rows)
+                        rows = []
+
+        if not started:
+            return
+
+        parser.close()
+        if len(rows) > 0:
+            yield normalize_infotable(pd.DataFrame(rows), offset=offset)
+
+
+def stream_nc(filename, chunk_rows=1000):
+    """A function that reads a .nc file without loading its info table at once.
+    Unlike read_nc(), only the (small) submission is parsed upfront. The info
+    table is parsed incrementally while the returned generator is consumed and
+    handed out in preprocessed chunks of at most chunk_rows rows, so memory stays
+    bounded no matter how many positions the filing has or how its XML is split
+    into lines. The file is only open while the generator is consumed, so a
+    generator that's never consumed doesn't leak it.
 
     Args:
-        infotable (dict): A dictionary with the filing's info table.
-        filing_id (str): The portfolio's filing_id. Appends an extra column to the
-            dataframe containing the filing_id which is part of the relation's primary key.
-            Only required for database purposes.
+        filename (str): The absolute filepath.
+        chunk_rows (int): The maximum number of rows per chunk.
 
     Returns:
-        pd.DataFrame: The preprocessed dataframe.
-
+        tuple(dict, generator): The processed submission (see process_submission())
+            and a generator of preprocessed info table chunks (see normalize_infotable()).
 
     """
 
-    if type(infotable["informationTable"]["infoTable"]) != list:
-        df_raw = pd.DataFrame([infotable["informationTable"]["infoTable"]])
-    else:
-        df_raw = pd.DataFrame(infotable["informationTable"]["infoTable"])
+    with open(filename, "rb") as f:
+        submission = b"".join(_xml_pieces(f)).strip()
+        start = f.tell()
 
-    if df_raw.shape == (1, 1):
-        return empty_df
+    if len(submission) == 0:
+        raise ValueError(f"No submission found in {filename}")
+
+    s_dict = process_submission(
+        xmltodict.parse(
+            ET.tostring(ET.fromstring(submission), encoding="utf-8", method="xml"),
+            process_namespaces=True,
+            namespaces={
+                "http://www.sec.gov/edgar/thirteenffiler": None,
+                "http://www.sec.gov/edgar/common": None,
+            },
+        )
+    )
+
+    return (s_dict, _iter_infotable(filename, start, chunk_rows))
+
+
+def normalize_infotable(df_raw, offset=0):
+    """A function that preprocesses raw info table rows (see process_infotable()).
+    Used on the whole info table or on consecutive chunks of it. Rows are numbered
+    starting at offset, so the chunks of a filing get the same portfolio_ids as
+    the whole info table would.
+
+    Args:
+        df_raw (pd.DataFrame): The raw info table rows, one row per infoTable entry.
+        offset (int): The portfolio_id of the first row.
+
+    Returns:
+        pd.DataFrame: The preprocessed dataframe.
+
+    """
+
+    df_raw.index = pd.RangeIndex(offset, offset + len(df_raw))
 
     for col in ["putCall", "otherManager"]:
         if col not in df_raw.columns:
@@ -168,7 +301,41 @@ def process_infotable(infotable, filing_id=None):
             ]
         )
     except Exception as e:
-        print(str(e))
+        raise ValueError(f"Malformed info table: {e!r}") from e
+
+    return df
+
+
+def process_infotable(infotable, filing_id=None):
+    """A function that processes the raw info table dictionary.
+    The function first checks for edge scenarios such as an empty portfolio or
+    with only one entry. Second, sometimes columns are missing in the info table
+    as they're not part of the filing. The function appends missing columns to keep
+    the database entries consistent. Third, preprocessing. Explode nested columns,
+    rename columns, add portfolio_id, convert str to int (first to float due to
+    formatting issues), convert str to upper str, correctly order the columns.
+
+    Args:
+        infotable (dict): A dictionary with the filing's info table.
+        filing_id (str): The portfolio's filing_id. Appends an extra column to the
+            dataframe containing the filing_id which is part of the relation's primary key.
+            Only required for database purposes.
+
+    Returns:
+        pd.DataFrame: The preprocessed dataframe.
+
+
+    """
+
+    if type(infotable["informationTable"]["infoTable"]) != list:
+        df_raw = pd.DataFrame([infotable["informationTable"]["infoTable"]])
+    else:
+        df_raw = pd.DataFrame(infotable["informationTable"]["infoTable"])
+
+    if df_raw.shape == (1, 1):
+        return empty_df
+
+    df = normalize_infotable(df_raw)
 
     if filing_id is None:
         return df
@@ -176,6 +343,24 @@ def process_infotable(infotable, filing_id=None):
         return df.assign(filing_id=filing_id)
 
 
+def amendment_type(submission):
+    """A function that extracts the amendment type of a filing's submission.
+
+    Args:
+        submission (dict): The submission dictionary.
+
+    Returns:
+        str: RESTATEMENT or NEW HOLDINGS for amendments, None for original reports.
+
+    """
+
+    info = submission["edgarSubmission"]["formData"]["coverPage"].get("amendmentInfo")
+    if not isinstance(info, dict) or not info.get("amendmentType"):
+        return None
+
+    return info["amendmentType"].strip().upper()
+
+
 def process_submission(submission):
     """A functio to extract relevant information from the filing's submission table.
 
@@ -225,4 +410,5 @@ def process_submission(submission):
             ),
             "%m-%d-%Y",
         ),
+        "amendmentType": amendment_type(submission),
     }
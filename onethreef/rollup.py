@@ -0,0 +1,610 @@
+import re
+
+import pandas as pd
+import psycopg2.extras
+
+from onethreef.constants import empty_df
+from onethreef.delta import reconstruct_query
+from onethreef.write import (
+    check_filing_portfolio_exists,
+    check_portfolio_exists,
+    run_query,
+)
+
+filer_columns = ["periodofreport", "cik", "filings", "positions", "value"]
+security_columns = [
+    "periodofreport",
+    "cusip",
+    "filings",
+    "positions",
+    "value",
+    "shares",
+]
+
+
+def create_rollup_tables(conn):
+    """Database query to create the rollup relations if they don't exist yet.
+    'filer_rollup' holds the number of filings, number of positions and total value
+    (13F AUM) per period and filer. 'security_rollup' holds the number of filings
+    reporting the security, number of positions, total value and total share count
+    per period and cusip. 'rollup_filing' records which filings are already
+    included in the rollups, so updates are applied exactly once, and whether a
+    filing is currently active, i.e. not superseded by a restatement of the same
+    report. 'filing_amendment' holds the amendment type of filings that were
+    loaded without the rollup stage (see record_amendment()). 'security_holder'
+    is the lookup of which filings (and filers) hold a cusip, so a security's
+    holders can be found without scanning every portfolio relation.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        Nothing.
+
+    """
+
+    q = """
+    CREATE TABLE IF NOT EXISTS filer_rollup (
+        periodofreport TIMESTAMP,
+        cik VARCHAR,
+        filings INTEGER,
+        positions INTEGER,
+        value BIGINT,
+        PRIMARY KEY (periodofreport, cik)
+    );
+    CREATE TABLE IF NOT EXISTS security_rollup (
+        periodofreport TIMESTAMP,
+        cusip VARCHAR,
+        filings INTEGER,
+        positions INTEGER,
+        value BIGINT,
+        shares BIGINT,
+        PRIMARY KEY (periodofreport, cusip)
+    );
+    CREATE TABLE IF NOT EXISTS rollup_filing (
+        filing_id BIGINT PRIMARY KEY
+    );
+    ALTER TABLE rollup_filing
+        ADD COLUMN IF NOT EXISTS cik VARCHAR,
+        ADD COLUMN IF NOT EXISTS periodofreport TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS amendmenttype VARCHAR,
+        ADD COLUMN IF NOT EXISTS active BOOLEAN DEFAULT TRUE;
+    UPDATE rollup_filing r
+    SET cik = c.cik, periodofreport = f.periodofreport
+    FROM filing f JOIN company c USING (company_id)
+    WHERE r.filing_id = f.filing_id AND r.cik IS NULL;
+    CREATE INDEX IF NOT EXISTS rollup_filing_report ON rollup_filing (cik, periodofreport);
+    CREATE TABLE IF NOT EXISTS filing_amendment (
+        filing_id BIGINT PRIMARY KEY,
+        amendmenttype VARCHAR
+    );
+    CREATE TABLE IF NOT EXISTS security_holder (
+        cusip VARCHAR,
+        periodofreport TIMESTAMP,
+        cik VARCHAR,
+        filing_id BIGINT,
+        PRIMARY KEY (cusip, periodofreport, filing_id)
+    );
+    CREATE INDEX IF NOT EXISTS security_holder_filing ON security_holder (filing_id);
+    """
+    with conn.cursor() as cur:
+        cur.execute(q)
+    conn.commit()
+
+
+def security_totals(df):
+    """A function that aggregates a filing's positions per cusip for the rollups.
+    The totals of several chunks of the same filing can be combined with
+    DataFrame.add(other, fill_value=0).
+
+    Args:
+        df (pd.DataFrame): A preprocessed info table (see process_infotable()).
+
+    Returns:
+        pd.DataFrame: Columns positions, value and shares, indexed by cusip.
+
+    """
+
+    return (
+        df.assign(shares=lambda df: df.sshprnamt.where(df.sshprnamttype == "SH", 0))
+        .groupby("cusip")
+        .agg(
+            positions=("value", "size"),
+            value=("value", "sum"),
+            shares=("shares", "sum"),
+        )
+    )
+
+
+def record_amendment(conn, filing_id, amendmenttype, commit=True):
+    """Database query that records a filing's amendment type for sync_rollups().
+    Only needed for filings that are loaded without the rollup stage (e.g. bulk
+    loads), update_rollups() gets the amendment type directly.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        filing_id (int): The filing's filing_id.
+        amendmenttype (str): RESTATEMENT, NEW HOLDINGS or None for original reports.
+        commit (bool): Commits the insert if True.
+
+    Returns:
+        Nothing.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO filing_amendment (filing_id, amendmenttype) VALUES (%s, %s)
+            ON CONFLICT (filing_id) DO UPDATE SET amendmenttype = EXCLUDED.amendmenttype
+            """,
+            (int(filing_id), amendmenttype),
+        )
+    if commit:
+        conn.commit()
+
+
+def check_rollup_exists(conn, filing_id):
+    """Database query to check if a filing is already included in the rollups.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        filing_id (int): The filing's filing_id.
+
+    Returns:
+        False if the filing isn't included, True if it is
+
+    """
+
+    q = f"SELECT EXISTS(SELECT * FROM rollup_filing WHERE filing_id = {int(filing_id)})"
+
+    return run_query(conn, q)[0][0]
+
+
+def _report_changes(cur, condition, params):
+    """Helper function that decides which filings of the reports (cik and period)
+    matching condition count towards the rollups. Filings are ordered by signature
+    date and acc number. The latest original report or restatement replaces all
+    earlier filings of the report, 'NEW HOLDINGS' amendments filed after it add to
+    it. Returns (filing_id, active, should be active) of every filing whose state
+    has to change.
+
+    """
+
+    cur.execute(
+        f"""
+        WITH ordered AS (
+            SELECT
+            r.filing_id,
+            r.active,
+            r.amendmenttype,
+            r.cik,
+            r.periodofreport,
+            row_number() OVER (
+                PARTITION BY r.cik, r.periodofreport
+                ORDER BY f.signaturedate, f.accnumber
+            ) AS n
+            FROM rollup_filing r JOIN filing f USING (filing_id)
+            WHERE {condition}
+        ), based AS (
+            SELECT
+            *,
+            MAX(n) FILTER (
+                WHERE amendmenttype IS DISTINCT FROM 'NEW HOLDINGS'
+            ) OVER (PARTITION BY cik, periodofreport) AS base
+            FROM ordered
+        ), decided AS (
+            SELECT
+            filing_id,
+            active,
+            CASE
+                WHEN base IS NULL THEN TRUE
+                WHEN amendmenttype = 'NEW HOLDINGS' THEN n > base
+                ELSE n = base
+            END AS desired
+            FROM based
+        )
+        SELECT filing_id, active, desired FROM decided WHERE active <> desired
+        """,
+        params,
+    )
+
+    return cur.fetchall()
+
+
+def stored_totals(conn, cik, filing_id):
+    """Database query that aggregates the stored positions of a filing per cusip,
+    from the portfolio relation or from compact storage.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (int): The filing's filing_id.
+
+    Returns:
+        pd.DataFrame: Columns positions, value and shares, indexed by cusip
+            (see security_totals()).
+
+    """
+
+    if check_portfolio_exists(conn, cik) and check_filing_portfolio_exists(
+        conn, cik, filing_id
+    ):
+        source = f"SELECT * FROM c{cik} WHERE filing_id = %(filing_id)s"
+    elif run_query(conn, f"SELECT to_regclass('d{cik}') IS NOT NULL")[0][0]:
+        source = reconstruct_query(cik)
+    else:
+        return security_totals(empty_df)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT
+            cusip,
+            COUNT(*),
+            SUM(value),
+            SUM(CASE WHEN sshprnamttype = 'SH' THEN sshprnamt ELSE 0 END)
+            FROM ({source}) p
+            GROUP BY cusip
+            """,
+            {"cik": cik, "filing_id": int(filing_id)},
+        )
+        return pd.DataFrame(
+            cur.fetchall(), columns=["cusip", "positions", "value", "shares"]
+        ).set_index("cusip")
+
+
+def _apply_totals(cur, totals, cik, periodofreport, sign):
+    """Helper function that adds (sign 1) or subtracts (sign -1) a filing's per
+    cusip totals to or from the rollup relations.
+
+    """
+
+    cur.execute(
+        """
+        INSERT INTO filer_rollup (periodofreport, cik, filings, positions, value)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (periodofreport, cik) DO UPDATE SET
+            filings = filer_rollup.filings + EXCLUDED.filings,
+            positions = filer_rollup.positions + EXCLUDED.positions,
+            value = filer_rollup.value + EXCLUDED.value
+        """,
+        (
+            periodofreport,
+            cik,
+            sign,
+            sign * int(totals["positions"].sum()),
+            sign * int(totals["value"].sum()),
+        ),
+    )
+
+    if len(totals) > 0:
+        psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO security_rollup
+            (periodofreport, cusip, filings, positions, value, shares)
+            VALUES %s
+            ON CONFLICT (periodofreport, cusip) DO UPDATE SET
+                filings = security_rollup.filings + EXCLUDED.filings,
+                positions = security_rollup.positions + EXCLUDED.positions,
+                value = security_rollup.value + EXCLUDED.value,
+                shares = security_rollup.shares + EXCLUDED.shares
+            """,
+            [
+                (
+                    periodofreport,
+                    cusip,
+                    sign,
+                    sign * int(row[0]),
+                    sign * int(row[1]),
+                    sign * int(row[2]),
+                )
+                for cusip, row in zip(
+                    totals.index,
+                    totals[["positions", "value", "shares"]].to_numpy(),
+                )
+            ],
+        )
+
+
+def _drop_empty(cur, periods):
+    """Helper function that deletes the periods' rollup rows without any active filing."""
+
+    cur.execute(
+        """
+        DELETE FROM filer_rollup WHERE periodofreport = ANY(%(periods)s) AND filings <= 0;
+        DELETE FROM security_rollup WHERE periodofreport = ANY(%(periods)s) AND filings <= 0;
+        """,
+        {"periods": list(periods)},
+    )
+
+
+def update_rollups(conn, totals, cik, filing_id, periodofreport, amendmenttype=None):
+    """Adds a single filing's contribution to the rollup relations.
+    The filing's per cusip totals are upserted, adding onto the existing rows of
+    the period and the filing's cusips are added to 'security_holder'. Filings
+    already recorded in 'rollup_filing' are skipped, so loading the same filing
+    twice doesn't count it twice. Commits the connection's open transaction in
+    either case, so a filing's positions can be written in the same transaction
+    as its rollups.
+
+    A restatement (or a later original report) of the same period replaces the
+    filer's earlier filings of that period: their stored positions are subtracted
+    again. 'NEW HOLDINGS' amendments are added on top. A filing that arrives after
+    the filing that replaces it isn't added at all (see _report_changes()).
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        totals (pd.DataFrame): The filing's per cusip totals (see security_totals()).
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (int): The filing's filing_id.
+        periodofreport (datetime.datetime): The filing's period of report.
+        amendmenttype (str): RESTATEMENT, NEW HOLDINGS or None for original reports.
+
+    Returns:
+        bool: True if the rollups were updated, False if the filing was already included.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"rollup{cik}",))
+        cur.execute(
+            """
+            INSERT INTO rollup_filing
+            (filing_id, cik, periodofreport, amendmenttype, active)
+            VALUES (%s, %s, %s, %s, FALSE)
+            ON CONFLICT DO NOTHING
+            RETURNING filing_id
+            """,
+            (int(filing_id), cik, periodofreport, amendmenttype),
+        )
+        if cur.fetchone() is None:
+            conn.commit()
+            return False
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO security_holder VALUES %s ON CONFLICT DO NOTHING",
+            [
+                (cusip, periodofreport, cik, int(filing_id))
+                for cusip in totals.index
+                if cusip is not None
+            ],
+        )
+
+        changes = _report_changes(
+            cur,
+            "r.cik = %(cik)s AND r.periodofreport = %(periodofreport)s",
+            {"cik": cik, "periodofreport": periodofreport},
+        )
+        for changed_id, active, desired in changes:
+            if changed_id == int(filing_id):
+                changed_totals = totals
+            else:
+                changed_totals = stored_totals(conn, cik, changed_id)
+            _apply_totals(
+                cur, changed_totals, cik, periodofreport, 1 if desired else -1
+            )
+            cur.execute(
+                "UPDATE rollup_filing SET active = %s WHERE filing_id = %s",
+                (desired, changed_id),
+            )
+        _drop_empty(cur, [periodofreport])
+    conn.commit()
+
+    return True
+
+
+def sync_rollups(conn, ciks=None):
+    """Adds all filings to the rollups that are stored in a portfolio relation but
+    not yet recorded in 'rollup_filing'. Used to build the rollups for an existing
+    database or to catch up after loading without the rollup stage. The aggregation
+    runs inside PostgreSQL, one portfolio relation at a time. Restatements replace
+    the filer's earlier filings of the same period just like in update_rollups(),
+    the amendment types are read from 'filing_amendment'. Stored filings missing
+    from 'security_holder' are added to it as well.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        ciks (list): Only syncs the portfolio relations of these ciks if set.
+
+    Returns:
+        Nothing.
+
+    """
+
+    create_rollup_tables(conn)
+    if ciks is not None:
+        ciks = set(ciks)
+    tables = [
+        t[0]
+        for t in run_query(
+            conn,
+            """
+            SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = ANY(current_schemas(false))
+            """,
+        )
+        if re.fullmatch(r"c\d+", t[0]) and (ciks is None or t[0][1:] in ciks)
+    ]
+    conn.commit()
+
+    register = """
+    SELECT pg_advisory_xact_lock(hashtext('rollup{cik}'));
+
+    CREATE TEMPORARY TABLE pending ON COMMIT DROP AS
+    SELECT p.filing_id, f.periodofreport
+    FROM (SELECT DISTINCT filing_id FROM {table}) p JOIN filing f USING (filing_id)
+    WHERE NOT EXISTS (SELECT 1 FROM rollup_filing r WHERE r.filing_id = p.filing_id);
+
+    INSERT INTO rollup_filing (filing_id, cik, periodofreport, amendmenttype, active)
+    SELECT p.filing_id, '{cik}', p.periodofreport, a.amendmenttype, FALSE
+    FROM pending p LEFT JOIN filing_amendment a USING (filing_id);
+
+    INSERT INTO security_holder
+    SELECT DISTINCT p.cusip, f.periodofreport, '{cik}', p.filing_id
+    FROM {table} p JOIN filing f USING (filing_id)
+    WHERE
+    p.cusip IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM security_holder h WHERE h.filing_id = p.filing_id)
+    ON CONFLICT DO NOTHING;
+    """
+
+    q = """
+    CREATE TEMPORARY TABLE contribution ON COMMIT DROP AS
+    SELECT
+        f.periodofreport,
+        x.filing_id,
+        x.sign,
+        p.cusip,
+        COUNT(p.cusip) AS positions,
+        COALESCE(SUM(p.value), 0) AS value,
+        COALESCE(SUM(CASE WHEN p.sshprnamttype = 'SH' THEN p.sshprnamt ELSE 0 END), 0) AS shares
+    FROM flip x
+    JOIN filing f USING (filing_id)
+    LEFT JOIN {table} p USING (filing_id)
+    GROUP BY f.periodofreport, x.filing_id, x.sign, p.cusip;
+
+    INSERT INTO filer_rollup (periodofreport, cik, filings, positions, value)
+    SELECT periodofreport, '{cik}', SUM(sign), SUM(sign * positions), SUM(sign * value)
+    FROM (
+        SELECT periodofreport, filing_id, sign, SUM(positions) AS positions, SUM(value) AS value
+        FROM contribution
+        GROUP BY periodofreport, filing_id, sign
+    ) c
+    GROUP BY periodofreport
+    ON CONFLICT (periodofreport, cik) DO UPDATE SET
+        filings = filer_rollup.filings + EXCLUDED.filings,
+        positions = filer_rollup.positions + EXCLUDED.positions,
+        value = filer_rollup.value + EXCLUDED.value;
+
+    INSERT INTO security_rollup (periodofreport, cusip, filings, positions, value, shares)
+    SELECT
+        periodofreport,
+        cusip,
+        SUM(sign),
+        SUM(sign * positions),
+        SUM(sign * value),
+        SUM(sign * shares)
+    FROM contribution
+    WHERE cusip IS NOT NULL
+    GROUP BY periodofreport, cusip
+    ON CONFLICT (periodofreport, cusip) DO UPDATE SET
+        filings = security_rollup.filings + EXCLUDED.filings,
+        positions = security_rollup.positions + EXCLUDED.positions,
+        value = security_rollup.value + EXCLUDED.value,
+        shares = security_rollup.shares + EXCLUDED.shares;
+
+    UPDATE rollup_filing r SET active = x.sign > 0
+    FROM flip x
+    WHERE r.filing_id = x.filing_id;
+    """
+
+    for table in tables:
+        cik = table[1:]
+        with conn.cursor() as cur:
+            cur.execute(register.format(table=table, cik=cik))
+            changes = _report_changes(
+                cur,
+                "(r.cik, r.periodofreport) IN (SELECT %(cik)s, periodofreport FROM pending)",
+                {"cik": cik},
+            )
+
+            # Filings stored in this relation are applied set-based, others
+            # (e.g. in compact storage) one by one
+            stored = {
+                r[0]
+                for r in run_query(
+                    conn,
+                    f"SELECT DISTINCT filing_id FROM {table} WHERE filing_id IN "
+                    f"({','.join(str(int(c[0])) for c in changes) or 'NULL'})",
+                )
+            }
+            cur.execute(
+                "CREATE TEMPORARY TABLE flip (filing_id BIGINT, sign INTEGER) ON COMMIT DROP"
+            )
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO flip VALUES %s",
+                [(c[0], 1 if c[2] else -1) for c in changes if c[0] in stored],
+            )
+            cur.execute(q.format(table=table, cik=cik))
+
+            for changed_id, active, desired in changes:
+                if changed_id in stored:
+                    continue
+                periodofreport = run_query(
+                    conn,
+                    f"SELECT periodofreport FROM filing WHERE filing_id = {int(changed_id)}",
+                )[0][0]
+                _apply_totals(
+                    cur,
+                    stored_totals(conn, cik, changed_id),
+                    cik,
+                    periodofreport,
+                    1 if desired else -1,
+                )
+                cur.execute(
+                    "UPDATE rollup_filing SET active = %s WHERE filing_id = %s",
+                    (desired, changed_id),
+                )
+            cur.execute("SELECT DISTINCT periodofreport FROM pending")
+            _drop_empty(cur, [r[0] for r in cur.fetchall()])
+        conn.commit()
+
+
+def _query_rollup(conn, table, columns, key, value, periodofreport):
+    """Helper function that selects rows of a rollup relation into a dataframe."""
+
+    conditions, params = [], []
+    if value is not None:
+        conditions.append(f"{key} = %s")
+        params.append(value)
+    if periodofreport is not None:
+        conditions.append("periodofreport = %s")
+        params.append(periodofreport)
+
+    q = f"SELECT {','.join(columns)} FROM {table}"
+    if len(conditions) > 0:
+        q += " WHERE " + " AND ".join(conditions)
+    q += f" ORDER BY periodofreport, {key}"
+
+    with conn.cursor() as cur:
+        cur.execute(q, params)
+        return pd.DataFrame(cur.fetchall(), columns=columns)
+
+
+def filer_rollup(conn, cik=None, periodofreport=None):
+    """Database query for the per period and filer rollup.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): Only returns rows of this filer if set (e.g. 0001162781).
+        periodofreport (datetime.datetime or str): Only returns rows of this period if set.
+
+    Returns:
+        pd.DataFrame: Columns periodofreport, cik, filings, positions and value.
+
+    """
+
+    return _query_rollup(
+        conn, "filer_rollup", filer_columns, "cik", cik, periodofreport
+    )
+
+
+def security_rollup(conn, cusip=None, periodofreport=None):
+    """Database query for the per period and security rollup.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cusip (str): Only returns rows of this security if set (e.g. 037833100).
+        periodofreport (datetime.datetime or str): Only returns rows of this period if set.
+
+    Returns:
+        pd.DataFrame: Columns periodofreport, cusip, filings, positions, value and shares.
+
+    """
+
+    return _query_rollup(
+        conn, "security_rollup", security_columns, "cusip", cusip, periodofreport
+    )
@@ -0,0 +1,464 @@
+import asyncio
+import io
+import json
+import re
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.ipc
+from aiohttp import web
+from psycopg2.pool import ThreadedConnectionPool
+
+from onethreef.constants import _init_connection, postgres_url
+from onethreef.delta import portfolio_columns, reconstruct_query
+from onethreef.write import run_query
+
+jsonl_type = "application/x-ndjson"
+arrow_type = "application/vnd.apache.arrow.stream"
+pg_arrow_types = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+}
+holders_batch = 100
+
+
+class ResponseCache:
+    """In-memory LRU cache of serialized responses with a time to live.
+
+    Entries are tagged (e.g. with the cik of a portfolio) so that a new filing only
+    invalidates the responses it affects. Every invalidation bumps generation,
+    which lets a request that started before the invalidation detect that its
+    result may be stale and must not be cached.
+
+    """
+
+    def __init__(self, max_entries=1024, ttl=300, max_entry_bytes=16 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.entries = OrderedDict()
+        self.generation = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, tags, body, generation):
+        if generation != self.generation or len(body) > self.max_entry_bytes:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, set(tags), body)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, tags):
+        self.generation += 1
+        tags = set(tags)
+        for key in [k for k, v in self.entries.items() if v[1] & tags]:
+            del self.entries[key]
+
+
+def _response_format(request):
+    """Helper function that picks Arrow or JSON lines based on the request."""
+
+    if request.query.get("format") == "arrow" or arrow_type in request.headers.get(
+        "Accept", ""
+    ):
+        return arrow_type
+
+    return jsonl_type
+
+
+def _arrow_schema(description):
+    """Helper function that maps a psycopg2 cursor description to an Arrow schema."""
+
+    return pa.schema(
+        [(c.name, pg_arrow_types.get(c.type_code, pa.string())) for c in description]
+    )
+
+
+async def _rows(pool, slots, queries, chunk_size=2000):
+    """Helper function that runs queries on a pooled connection and yields the
+    cursor description of the first query followed by chunks of rows of all
+    queries. Each query runs in its own transaction, so the locks it took are
+    released before the next one starts. A server-side cursor keeps large results
+    out of memory, all blocking calls run in the default executor. slots holds
+    one semaphore slot per pooled connection, so a burst of requests waits for a
+    free connection instead of exhausting the pool.
+
+    """
+
+    loop = asyncio.get_event_loop()
+    async with slots:
+        conn = await loop.run_in_executor(None, pool.getconn)
+        try:
+            described = False
+            for query, params in queries:
+                cur = conn.cursor(name="onethreef_serve")
+                cur.itersize = chunk_size
+                await loop.run_in_executor(None, cur.execute, query, params)
+                rows = await loop.run_in_executor(None, cur.fetchmany, chunk_size)
+                if not described:
+                    yield cur.description
+                    described = True
+                while len(rows) > 0:
+                    yield rows
+                    rows = await loop.run_in_executor(None, cur.fetchmany, chunk_size)
+                cur.close()
+                conn.rollback()
+        finally:
+            conn.rollback()
+            pool.putconn(conn)
+
+
+async def _stream(request, key, tags, queries):
+    """Helper function that answers a request from the cache or streams the query
+    results as JSON lines or Arrow and caches them afterwards. queries is a list
+    of tuples (query, params) or a coroutine function returning one, which is
+    only awaited on a cache miss.
+
+    """
+
+    cache = request.app["cache"]
+    content_type = _response_format(request)
+    key = (content_type,) + key
+
+    body = cache.get(key)
+    if body is not None:
+        return web.Response(body=body, content_type=content_type)
+
+    generation = cache.generation
+    if callable(queries):
+        queries = await queries()
+    rows = _rows(request.app["pool"], request.app["pool_slots"], queries)
+    try:
+        description = await rows.__anext__()
+        response = web.StreamResponse(headers={"Content-Type": content_type})
+        await response.prepare(request)
+        chunks = await _write_rows(response, rows, description, content_type)
+        await response.write_eof()
+    finally:
+        await rows.aclose()
+
+    cache.put(key, tags, b"".join(chunks), generation)
+
+    return response
+
+
+async def _write_rows(response, rows, description, content_type):
+    """Helper function that serializes chunks of rows and writes them to the response.
+    Returns the written chunks, so they can be cached.
+
+    """
+
+    chunks = []
+    columns = [c.name for c in description]
+
+    if content_type == arrow_type:
+        schema = _arrow_schema(description)
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        async for chunk in rows:
+            writer.write_batch(
+                pa.RecordBatch.from_arrays(
+                    [
+                        pa.array([r[i] for r in chunk], type=field.type)
+                        for i, field in enumerate(schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            chunks.append(sink.getvalue())
+            sink.seek(0)
+            sink.truncate()
+            await response.write(chunks[-1])
+        writer.close()
+        chunks.append(sink.getvalue())
+        await response.write(chunks[-1])
+    else:
+        async for chunk in rows:
+            chunks.append(
+                "".join(
+                    json.dumps(dict(zip(columns, r)), default=str) + "\n" for r in chunk
+                ).encode()
+            )
+            await response.write(chunks[-1])
+
+    return chunks
+
+
+async def portfolio(request):
+    """GET /portfolio/{cik}: The positions of a company's filing.
+    Returns the latest filing (by period of report) unless the accnumber query
+    parameter selects a specific one. Filings in compact storage are reconstructed
+    on the fly (see reconstruct_query()), unless the filing is also stored in the
+    portfolio relation.
+
+    """
+
+    cik = request.match_info["cik"]
+    if not re.fullmatch(r"\d+", cik):
+        raise web.HTTPBadRequest(text="cik must be numeric")
+
+    cols = ",".join(portfolio_columns)
+    parts = []
+    if cik in request.app["tables"]:
+        parts.append(
+            f"SELECT {cols} FROM c{cik} WHERE filing_id = (SELECT filing_id FROM target)"
+        )
+    if cik in request.app["compact"]:
+        # A filing stored in both is read from the portfolio relation only
+        stored = ""
+        if len(parts) > 0:
+            stored = f"WHERE NOT EXISTS ({parts[0]})"
+        parts.append(
+            f"SELECT {cols} FROM ({reconstruct_query(cik, '(SELECT filing_id FROM target)')}) d {stored}"
+        )
+    if len(parts) == 0:
+        raise web.HTTPNotFound(text=f"no portfolio for cik {cik}")
+
+    accnumber = request.query.get("accnumber")
+    q = f"""
+    WITH target AS (
+        SELECT f.filing_id, f.accnumber, f.periodofreport
+        FROM filing f JOIN company c USING (company_id)
+        WHERE c.cik = %(cik)s AND (%(accnumber)s IS NULL OR f.accnumber = %(accnumber)s)
+        ORDER BY f.periodofreport DESC, f.filing_id DESC
+        LIMIT 1
+    )
+    SELECT t.accnumber, t.periodofreport, p.*
+    FROM ({" UNION ALL ".join(parts)}) p JOIN target t USING (filing_id)
+    ORDER BY p.portfolio_id
+    """
+
+    return await _stream(
+        request,
+        ("portfolio", cik, accnumber),
+        [f"cik:{cik}"],
+        [(q, {"cik": cik, "accnumber": accnumber})],
+    )
+
+
+async def holders(request):
+    """GET /holders/{cusip}: All positions in a security across all portfolios.
+    The periodofreport query parameter (e.g. 2015-12-31) restricts the result
+    to a single period. The filings holding the security are looked up in
+    'security_holder' (see update_rollups()) and only their portfolio relations
+    are read, at most holders_batch companies per query. Filings in compact
+    storage are reconstructed on the fly (see reconstruct_query()), unless the
+    filing is also stored in the portfolio relation.
+
+    """
+
+    cusip = request.match_info["cusip"].upper()
+    period = request.query.get("periodofreport")
+    stored = request.app["tables"] | request.app["compact"]
+    if len(stored) == 0:
+        raise web.HTTPNotFound(text="no portfolios")
+
+    cols = ",".join(f"p.{c}" for c in portfolio_columns)
+
+    def select(cik):
+        parts = []
+        if cik in request.app["tables"]:
+            parts.append(
+                f"""
+                SELECT '{cik}' AS cik, f.accnumber, f.periodofreport, {cols}
+                FROM c{cik} p JOIN filing f USING (filing_id)
+                WHERE p.cusip = %(cusip)s AND p.filing_id = ANY(%(c{cik})s)
+                """
+            )
+        if cik in request.app["compact"]:
+            # A filing stored in both is read from the portfolio relation only
+            source = reconstruct_query(cik, "h.filing_id", f"%(k{cik})s")
+            skip = ""
+            if len(parts) > 0:
+                skip = f"AND NOT EXISTS (SELECT 1 FROM c{cik} x WHERE x.filing_id = h.filing_id)"
+            parts.append(
+                f"""
+                SELECT '{cik}' AS cik, f.accnumber, f.periodofreport, {cols}
+                FROM unnest(%(c{cik})s::BIGINT[]) h(filing_id)
+                CROSS JOIN LATERAL ({source}) p
+                JOIN filing f ON f.filing_id = h.filing_id
+                WHERE p.cusip = %(cusip)s {skip}
+                """
+            )
+        return " UNION ALL ".join(parts)
+
+    def params(ciks, filings):
+        values = {"cusip": cusip}
+        for cik in ciks:
+            values[f"c{cik}"] = filings.get(cik, [])
+            values[f"k{cik}"] = cik
+        return values
+
+    async def queries():
+        lookup = _rows(
+            request.app["pool"],
+            request.app["pool_slots"],
+            [
+                (
+                    """
+                    SELECT cik, array_agg(filing_id ORDER BY filing_id)
+                    FROM security_holder
+                    WHERE
+                    cusip = %(cusip)s
+                    AND (%(period)s::timestamp IS NULL OR periodofreport = %(period)s::timestamp)
+                    GROUP BY cik
+                    ORDER BY cik
+                    """,
+                    {"cusip": cusip, "period": period},
+                )
+            ],
+        )
+        await lookup.__anext__()
+        filings = {
+            cik: ids async for chunk in lookup for cik, ids in chunk if cik in stored
+        }
+        if len(filings) == 0:
+            cik = min(stored)
+            return [(select(cik), params([cik], filings))]
+
+        ciks = sorted(filings)
+        return [
+            (" UNION ALL ".join(select(cik) for cik in batch), params(batch, filings))
+            for batch in (
+                ciks[i : i + holders_batch] for i in range(0, len(ciks), holders_batch)
+            )
+        ]
+
+    return await _stream(request, ("holders", cusip, period), ["holders"], queries)
+
+
+async def filing(request):
+    """GET /filing/{accnumber}: The metadata of a filing and its company."""
+
+    accnumber = request.match_info["accnumber"]
+    q = """
+    SELECT f.filing_id, f.accnumber, f.filenumber, f.periodofreport, f.signaturedate,
+    c.cik, c.name, c.street1, c.street2, c.city, c.stateorcountry, c.zipcode
+    FROM filing f JOIN company c USING (company_id)
+    WHERE f.accnumber = %s
+    """
+
+    return await _stream(
+        request, ("filing", accnumber), [f"filing:{accnumber}"], [(q, (accnumber,))]
+    )
+
+
+def _portfolio_tables(prefix="c"):
+    """Helper function that returns the ciks of all portfolio relations, or of all
+    compact portfolio relations with prefix d.
+
+    """
+
+    conn = _init_connection()
+    try:
+        return {
+            t[0][1:]
+            for t in run_query(
+                conn,
+                """
+                SELECT TABLE_NAME FROM INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_SCHEMA = ANY(current_schemas(false))
+                """,
+            )
+            if re.fullmatch(rf"{prefix}\d+", t[0])
+        }
+    finally:
+        conn.close()
+
+
+async def _listen(app):
+    """Helper function that listens for 'onethreef_filing' notifications (see
+    notify_filing()) on a dedicated connection and invalidates the affected
+    cache entries: the filer's portfolios, the filing and all holders lookups.
+
+    """
+
+    loop = asyncio.get_event_loop()
+    conn = _init_connection()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("LISTEN onethreef_filing")
+
+    def on_notify():
+        conn.poll()
+        while conn.notifies:
+            payload = json.loads(conn.notifies.pop(0).payload)
+            app["compact" if payload.get("compact") else "tables"].add(payload["cik"])
+            app["cache"].invalidate(
+                [
+                    f"cik:{payload['cik']}",
+                    f"filing:{payload['accnumber']}",
+                    "holders",
+                ]
+            )
+
+    loop.add_reader(conn.fileno(), on_notify)
+    yield
+    loop.remove_reader(conn.fileno())
+    conn.close()
+
+
+async def _open_pool(app):
+    """Helper function that creates one semaphore slot per pooled connection on
+    startup, i.e. on the event loop that serves the requests (see _rows()).
+
+    """
+
+    app["pool_slots"] = asyncio.Semaphore(app["pool"].maxconn)
+
+
+async def _close_pool(app):
+    """Helper function that closes all pooled connections on shutdown."""
+
+    app["pool"].closeall()
+
+
+def create_app(pool_size=10, cache_size=1024, ttl=300):
+    """A function that creates the read-only HTTP query service.
+
+    Endpoints (responses are JSON lines, or an Arrow stream with ?format=arrow or
+    'Accept: application/vnd.apache.arrow.stream'):
+
+    - GET /portfolio/{cik}[?accnumber=...]
+    - GET /holders/{cusip}[?periodofreport=YYYY-MM-DD]
+    - GET /filing/{accnumber}
+
+    Args:
+        pool_size (int): The maximum number of pooled database connections.
+        cache_size (int): The maximum number of cached responses.
+        ttl (int): Seconds a cached response stays valid.
+
+    Returns:
+        aiohttp.web.Application: The application.
+
+    """
+
+    app = web.Application()
+    app["cache"] = ResponseCache(max_entries=cache_size, ttl=ttl)
+    app["tables"] = _portfolio_tables()
+    app["compact"] = _portfolio_tables("d")
+    app["pool"] = ThreadedConnectionPool(1, pool_size, postgres_url)
+    app.on_startup.append(_open_pool)
+    app.cleanup_ctx.append(_listen)
+    app.on_cleanup.append(_close_pool)
+    app.router.add_get("/portfolio/{cik}", portfolio)
+    app.router.add_get("/holders/{cusip}", holders)
+    app.router.add_get("/filing/{accnumber}", filing)
+
+    return app
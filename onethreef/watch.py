@@ -0,0 +1,203 @@
+import asyncio
+import os
+import pathlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as dt_date
+from datetime import timedelta
+
+import aiofiles
+import aiohttp
+from sqlmodel import Session
+
+from onethreef import rollup
+from onethreef.constants import (
+    _create_engine,
+    _init_connection,
+    archives_url,
+    daily_index_url,
+    headers,
+    storage_path,
+)
+from onethreef.fetch import download_filing, parse_index
+from onethreef.load import load_filing, record_failure
+from onethreef.write import check_filing_exists
+
+
+def quarter_of(date):
+    """A helper function that returns the year and quarter of a date string.
+
+    Args:
+        date (str): A date (e.g. 20160212).
+
+    Returns:
+        tuple(int, int): The year and the quarter.
+
+    """
+
+    return (int(date[:4]), (int(date[4:6]) - 1) // 3 + 1)
+
+
+async def fetch_daily_index(session, date, index_file=None):
+    """A function that fetches the daily form index of a date from SEC EDGAR.
+    The daily index has the same layout as the quarterly form.idx but only lists
+    the filings of a single day.
+
+    Args:
+        session (aiohttp.ClientSession): The client session.
+        date (str): The date (e.g. 20160212).
+        index_file (str): Reads this local file instead of requesting EDGAR if set.
+            Used for testing.
+
+    Returns:
+        str: The content of the index or an empty string if it isn't published yet.
+
+    """
+
+    if index_file is not None:
+        async with aiofiles.open(index_file, "r") as f:
+            return await f.read()
+
+    year, quarter = quarter_of(date)
+    url = daily_index_url.format(year=year, quarter=quarter, date=date)
+    async with session.get(url, headers=headers) as response:
+        if response.status != 200:
+            return ""
+        return await response.text(errors="replace")
+
+
+async def watch(
+    poll_interval=60,
+    max_inflight=50,
+    workers=4,
+    index_file=None,
+    form_type=["13F-HR", "13F-HR/A"],
+    use_cache=True,
+):
+    """A function that continuously loads new filings into the database.
+    Three stages run concurrently on the event loop:
+
+    1. The poller fetches today's and yesterday's daily index every poll_interval
+       seconds and queues every filing that hasn't been seen before and doesn't
+       have a record in the database yet (see check_filing_exists()). A failing
+       poll (e.g. a timeout or a database error) is logged and retried with the
+       next poll.
+    2. Fetch workers download the queued filings as .nc files into the quarter
+       directory (see download_filing()). Files that already exist are not
+       downloaded again.
+    3. The loader writes the downloaded files to the database (see load_filing()).
+       Failing filings are recorded in the dead letter file and skipped.
+
+    Both queues hold at most max_inflight filings. A full queue blocks the stage in
+    front of it, so a slow database throttles downloads and a slow download
+    throttles polling instead of piling up filings in memory. All database work
+    runs on a single background thread, so the event loop is never blocked.
+
+    Args:
+        poll_interval (int): Seconds between two polls of the daily index.
+        max_inflight (int): The maximum number of filings per queue.
+        workers (int): The number of concurrent downloads.
+        index_file (str): Polls this local file instead of EDGAR's daily index if set.
+        form_type (list): A list of SEC form types to load.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+
+    Returns:
+        Nothing. Runs until it's cancelled.
+
+    """
+
+    loop = asyncio.get_event_loop()
+    db = ThreadPoolExecutor(max_workers=1)
+    engine = _create_engine()
+    conn = await loop.run_in_executor(db, _init_connection)
+    sess = Session(engine)
+    await loop.run_in_executor(db, rollup.create_rollup_tables, conn)
+
+    to_fetch = asyncio.Queue(maxsize=max_inflight)
+    to_load = asyncio.Queue(maxsize=max_inflight)
+    sem = asyncio.Semaphore(workers)
+    seen = set()
+
+    def filing_exists(accno):
+        try:
+            return check_filing_exists(sess, accno)
+        except Exception:
+            sess.rollback()
+            raise
+
+    async def poll(session):
+        today = dt_date.today()
+        days = [today] if index_file else [today - timedelta(days=1), today]
+        for day in days:
+            text = await fetch_daily_index(
+                session, day.strftime("%Y%m%d"), index_file=index_file
+            )
+            for date, accno, path in parse_index(text, form_type=form_type):
+                if accno in seen:
+                    continue
+                seen.add(accno)
+                try:
+                    exists = await loop.run_in_executor(db, filing_exists, accno)
+                except Exception:
+                    seen.discard(accno)
+                    raise
+                if not exists:
+                    await to_fetch.put((date, accno, path))
+
+    async def poller(session):
+        while True:
+            try:
+                await poll(session)
+            except Exception as e:
+                print("failed poll", repr(e))
+            await asyncio.sleep(poll_interval)
+
+    async def fetcher(session):
+        while True:
+            date, accno, path = await to_fetch.get()
+            year, quarter = quarter_of(date)
+            directory = os.path.join(storage_path, str(year), f"QTR{quarter}")
+            nc = os.path.join(directory, f"{accno}.nc")
+            try:
+                if not os.path.exists(nc):
+                    pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+                    await download_filing(
+                        session,
+                        archives_url.format(path=path),
+                        nc,
+                        sem,
+                        min_duration=workers / 10,
+                    )
+                await to_load.put(nc)
+            except Exception as e:
+                print("failed", accno, repr(e))
+                seen.discard(accno)
+            finally:
+                to_fetch.task_done()
+
+    def load(nc):
+        try:
+            load_filing(sess, conn, nc, use_cache=use_cache)
+            print("loaded", nc)
+        except Exception as e:
+            sess.rollback()
+            conn.rollback()
+            record_failure(nc, e)
+            print("failed", nc, repr(e))
+
+    async def loader():
+        while True:
+            nc = await to_load.get()
+            await loop.run_in_executor(db, load, nc)
+            to_load.task_done()
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(
+                poller(session),
+                loader(),
+                *[fetcher(session) for _ in range(workers)],
+            )
+    finally:
+        await loop.run_in_executor(db, sess.close)
+        await loop.run_in_executor(db, conn.close)
+        db.shutdown()
@@ -0,0 +1,328 @@
+import os
+import socket
+import threading
+import time
+import traceback
+
+import psycopg2.extras
+from sqlmodel import Session
+
+from onethreef import rollup
+from onethreef.constants import _create_engine, _init_connection, storage_path
+from onethreef.load import load_filing, nc_accnumber
+from onethreef.write import run_query
+
+
+def create_work_table(conn):
+    """Database query to create the 'work_item' relation if it doesn't exist yet.
+    Each row is a single filing to load. status is one of pending, running, done
+    or failed. worker and heartbeat identify the worker that currently processes
+    a running item and when it last reported in.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        Nothing.
+
+    """
+
+    q = """
+    CREATE TABLE IF NOT EXISTS work_item (
+        accnumber VARCHAR PRIMARY KEY,
+        filename VARCHAR,
+        status VARCHAR DEFAULT 'pending',
+        worker VARCHAR,
+        attempts INTEGER DEFAULT 0,
+        heartbeat TIMESTAMP,
+        error VARCHAR,
+        enqueued_at TIMESTAMP DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS work_item_status ON work_item (status, enqueued_at);
+    """
+    with conn.cursor() as cur:
+        cur.execute(q)
+    conn.commit()
+
+
+def enqueue(conn, ncs):
+    """Adds .nc files to the work queue. Filenames are stored relative to the
+    storage path, so workers can mount the storage anywhere. Filings that are
+    already queued (in any status) are skipped.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        ncs (list): A list of absolute filepaths of .nc files.
+
+    Returns:
+        int: The number of newly queued filings.
+
+    """
+
+    create_work_table(conn)
+    with conn.cursor() as cur:
+        rows = psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO work_item (accnumber, filename) VALUES %s ON CONFLICT DO NOTHING RETURNING accnumber",
+            [(nc_accnumber(nc), os.path.relpath(nc, storage_path)) for nc in ncs],
+            fetch=True,
+        )
+    conn.commit()
+
+    return len(rows)
+
+
+def claim(conn, worker, stale_after=60, max_attempts=3):
+    """Database query that claims the oldest pending work item for a worker.
+    Running items whose heartbeat is older than stale_after seconds belong to a
+    dead worker and are claimed again, unless they already had max_attempts
+    attempts. Those are marked as failed instead, so a filing that keeps killing
+    its worker isn't retried forever. FOR UPDATE SKIP LOCKED lets any number of
+    workers claim concurrently without blocking each other or claiming the same item.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        worker (str): The worker's id.
+        stale_after (int): Seconds without heartbeat after which an item is reassigned.
+        max_attempts (int): The number of attempts before an item is marked as failed.
+
+    Returns:
+        tuple(str, str): The acc number and the absolute filepath of the claimed
+            filing or None if the queue is empty.
+
+    """
+
+    q_failed = """
+    UPDATE work_item
+    SET status = 'failed', error = COALESCE(error, 'worker stopped sending heartbeats')
+    WHERE accnumber IN (
+        SELECT accnumber
+        FROM work_item
+        WHERE
+        status = 'running'
+        AND heartbeat < now() - %(stale_after)s * interval '1 second'
+        AND attempts >= %(max_attempts)s
+        FOR UPDATE SKIP LOCKED
+    )
+    """
+    q = """
+    UPDATE work_item
+    SET status = 'running', worker = %(worker)s, heartbeat = now(), attempts = attempts + 1
+    WHERE accnumber = (
+        SELECT accnumber
+        FROM work_item
+        WHERE
+        status = 'pending'
+        OR (
+            status = 'running'
+            AND heartbeat < now() - %(stale_after)s * interval '1 second'
+            AND attempts < %(max_attempts)s
+        )
+        ORDER BY enqueued_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING accnumber, filename
+    """
+    params = {
+        "worker": worker,
+        "stale_after": stale_after,
+        "max_attempts": max_attempts,
+    }
+    with conn.cursor() as cur:
+        cur.execute(q_failed, params)
+        cur.execute(q, params)
+        item = cur.fetchone()
+    conn.commit()
+
+    if item is None:
+        return None
+
+    return (item[0], os.path.join(storage_path, item[1]))
+
+
+def heartbeat(conn, worker, accnumber):
+    """Database query that reports that a worker is still processing an item.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        worker (str): The worker's id.
+        accnumber (str): The acc number of the item.
+
+    Returns:
+        bool: False if the item was reassigned to another worker in the meantime.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE work_item SET heartbeat = now() WHERE accnumber = %s AND worker = %s AND status = 'running'",
+            (accnumber, worker),
+        )
+        updated = cur.rowcount
+    conn.commit()
+
+    return updated == 1
+
+
+def finish(conn, worker, accnumber, error=None, max_attempts=3):
+    """Database query that marks a worker's item as done or failed.
+    A failed item is queued again until it failed max_attempts times.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        worker (str): The worker's id.
+        accnumber (str): The acc number of the item.
+        error (str): The error (e.g. a traceback) if the item failed.
+        max_attempts (int): The number of attempts before an item is marked as failed.
+
+    Returns:
+        Nothing.
+
+    """
+
+    if error is None:
+        q = "UPDATE work_item SET status = 'done', error = NULL WHERE accnumber = %s AND worker = %s"
+        params = (accnumber, worker)
+    else:
+        q = """
+        UPDATE work_item
+        SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END, error = %s
+        WHERE accnumber = %s AND worker = %s
+        """
+        params = (max_attempts, error, accnumber, worker)
+
+    with conn.cursor() as cur:
+        cur.execute(q, params)
+    conn.commit()
+
+
+def queue_status(conn):
+    """Database query that counts the work items per status.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+
+    Returns:
+        dict: The number of items per status.
+
+    """
+
+    create_work_table(conn)
+    return dict(
+        run_query(conn, "SELECT status, COUNT(*) FROM work_item GROUP BY status")
+    )
+
+
+def _unfinished(conn):
+    """Helper function that checks whether any item is still pending or running."""
+
+    return run_query(
+        conn,
+        "SELECT EXISTS(SELECT * FROM work_item WHERE status IN ('pending', 'running'))",
+    )[0][0]
+
+
+def _beat(worker, current, stop, interval):
+    """Helper function that sends heartbeats for the current item until stop is set.
+    Runs in its own thread with its own connection, so heartbeats keep going while
+    the worker is busy loading a large filing.
+
+    """
+
+    conn = _init_connection()
+    try:
+        while not stop.wait(interval):
+            accnumber = current.get("accnumber")
+            if accnumber is not None:
+                heartbeat(conn, worker, accnumber)
+    finally:
+        conn.close()
+
+
+def run_worker(
+    worker=None,
+    poll_interval=5,
+    heartbeat_interval=10,
+    stale_after=60,
+    max_attempts=3,
+    exit_when_empty=False,
+    use_cache=True,
+    chunk_rows=None,
+):
+    """A function that claims and loads work items until it's interrupted.
+    Any number of workers on any number of hosts can run against the same database.
+    Each claimed filing is written with load_filing(), which is idempotent, so an
+    item that is reassigned after its worker died is simply loaded again.
+
+    Args:
+        worker (str): The worker's id. Defaults to {hostname}-{pid}.
+        poll_interval (float): Seconds to wait before polling an empty queue again.
+        heartbeat_interval (float): Seconds between two heartbeats.
+        stale_after (float): Seconds without heartbeat after which an item is reassigned.
+        max_attempts (int): The number of attempts before an item is marked as failed.
+        exit_when_empty (bool): Returns once no item is pending or running instead
+            of polling. Items of other workers that are still running keep the
+            worker polling, so it can take them over if their worker dies.
+        use_cache (bool): Reads already parsed filings from the parse cache if True.
+        chunk_rows (int): Streams info tables in chunks of this many rows if set.
+
+    Returns:
+        int: The number of loaded filings.
+
+    """
+
+    if worker is None:
+        worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    engine = _create_engine()
+    conn = _init_connection()
+    create_work_table(conn)
+    rollup.create_rollup_tables(conn)
+
+    current = {}
+    stop = threading.Event()
+    beater = threading.Thread(
+        target=_beat, args=(worker, current, stop, heartbeat_interval), daemon=True
+    )
+    beater.start()
+    loaded = 0
+
+    try:
+        with Session(engine) as sess:
+            while True:
+                item = claim(
+                    conn, worker, stale_after=stale_after, max_attempts=max_attempts
+                )
+                if item is None:
+                    if exit_when_empty and not _unfinished(conn):
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                accnumber, nc = item
+                current["accnumber"] = accnumber
+                try:
+                    load_filing(
+                        sess, conn, nc, use_cache=use_cache, chunk_rows=chunk_rows
+                    )
+                    finish(conn, worker, accnumber)
+                    loaded += 1
+                except Exception:
+                    sess.rollback()
+                    conn.rollback()
+                    finish(
+                        conn,
+                        worker,
+                        accnumber,
+                        error=traceback.format_exc(),
+                        max_attempts=max_attempts,
+                    )
+                finally:
+                    current.pop("accnumber", None)
+    finally:
+        stop.set()
+        beater.join()
+        conn.close()
+
+    return loaded
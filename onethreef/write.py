@@ -1,3 +1,4 @@
+import json
 from datetime import datetime as dt
 from typing import Optional
 
@@ -163,8 +164,35 @@ def check_portfolio_exists(conn, cik):
     return run_query(conn, q.format(cik))[0][0]
 
 
+def check_filing_portfolio_exists(conn, cik, filing_id):
+    """Database query to check if a filing's positions are already in the company's portfolio.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): A unique company identifier (e.g. 0001162781).
+        filing_id (int): The filing's filing_id.
+
+    Returns:
+        False if there are no positions of the filing, True if there are
+
+    """
+
+    q = """
+    SELECT EXISTS(
+        SELECT *
+        FROM c{}
+        WHERE
+        filing_id = {}
+    );
+    """
+
+    return run_query(conn, q.format(cik, int(filing_id)))[0][0]
+
+
 def create_portfolio_table(conn, cik):
     """Database query to create a company's portfolio based on its cik.
+    Takes an advisory lock on the table name first, so several processes can call
+    this for the same company at the same time without failing.
 
     Args:
         conn (psycopg2.extensions.connection): The psycopg2 connection.
@@ -176,7 +204,8 @@ def create_portfolio_table(conn, cik):
     """
 
     q = """
-    CREATE TABLE c{} (
+    SELECT pg_advisory_xact_lock(hashtext('c{0}'));
+    CREATE TABLE IF NOT EXISTS c{0} (
         portfolio_id INTEGER,
         nameofissuer VARCHAR,
         titleofclass VARCHAR,
@@ -200,13 +229,15 @@ def create_portfolio_table(conn, cik):
     conn.commit()
 
 
-def add_portfolio(conn, df, table):
+def add_portfolio(conn, df, table, commit=True):
     """Database query that uses psycopg2.extras.execute_values() to insert a dataframe.
 
     Args:
         conn (psycopg2.extensions.connection): The psycopg2 connection.
         df (pd.DataFrame): The dataframe to insert.
         table(str): The table name (e.g. c0001162781).
+        commit (bool): Commits the insert if True. Used to insert a filing's
+            chunks in a single transaction.
 
     Returns:
         Nothing.
@@ -220,9 +251,35 @@ def add_portfolio(conn, df, table):
 
     try:
         psycopg2.extras.execute_values(cursor, query, tuples)
-        conn.commit()
+        if commit:
+            conn.commit()
     except (Exception, psycopg2.DatabaseError) as error:
         print("Error: %s" % error)
         conn.rollback()
+        raise
+    finally:
         cursor.close()
-    cursor.close()
+
+
+def notify_filing(conn, cik, accnumber, compact=False):
+    """Database query that notifies listeners (e.g. the 'serve' command) that a
+    filing was written to the database. The payload is a JSON object with the
+    filing's cik, acc number and storage mode, sent on the 'onethreef_filing' channel.
+
+    Args:
+        conn (psycopg2.extensions.connection): The psycopg2 connection.
+        cik (str): A unique company identifier (e.g. 0001162781).
+        accnumber (str): A unique accnumber (e.g. 0001162781-22-000001).
+        compact (bool): True if the filing was written to compact storage.
+
+    Returns:
+        Nothing.
+
+    """
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT pg_notify('onethreef_filing', %s)",
+            (json.dumps({"cik": cik, "accnumber": accnumber, "compact": compact}),),
+        )
+    conn.commit()
@@ -0,0 +1,41 @@
+import os
+
+import psycopg2
+import pytest
+from sqlmodel import SQLModel
+
+from onethreef import constants
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """A throwaway schema in the database at ONETHREEF_TEST_DSN with the company and
+    filing relations. Every connection onethreef opens during the test uses it.
+
+    """
+
+    dsn = os.environ.get("ONETHREEF_TEST_DSN")
+    if dsn is None:
+        pytest.skip("ONETHREEF_TEST_DSN isn't set")
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"database isn't reachable: {e}")
+
+    schema = f"onethreef_test_{os.getpid()}"
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE; CREATE SCHEMA {schema}")
+    conn.commit()
+
+    url = f"{dsn}{'&' if '?' in dsn else '?'}options=-csearch_path%3D{schema}"
+    monkeypatch.setattr(constants, "postgres_url", url)
+    engine = constants._create_engine()
+    SQLModel.metadata.create_all(engine)
+    engine.dispose()
+
+    yield url
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
@@ -0,0 +1,127 @@
+from datetime import datetime as dt
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from onethreef import analytics
+
+
+def holdings(rows):
+    return pd.DataFrame(rows, columns=["cik", "cusip", "value"])
+
+
+def test_build_matrix_weights_rows_by_portfolio_value():
+    m, ciks, cusips = analytics.build_matrix(
+        holdings(
+            [
+                ("0000000002", "BBB", 30),
+                ("0000000001", "AAA", 10),
+                ("0000000001", "BBB", 20),
+                ("0000000001", "AAA", 10),
+                ("0000000002", "CCC", 0),
+            ]
+        )
+    )
+
+    assert list(ciks) == ["0000000001", "0000000002"]
+    assert list(cusips) == ["AAA", "BBB"]
+    np.testing.assert_allclose(m.toarray(), [[0.5, 0.5], [0, 1]])
+
+
+def test_top_k_similar_ranks_overlapping_filers():
+    m, ciks, _ = analytics.build_matrix(
+        holdings(
+            [
+                ("1", "AAA", 50),
+                ("1", "BBB", 50),
+                ("2", "AAA", 100),
+                ("2", "BBB", 100),
+                ("3", "AAA", 90),
+                ("3", "CCC", 10),
+                ("4", "DDD", 10),
+            ]
+        )
+    )
+
+    df = analytics.top_k_similar(m, ciks, k=2, block_size=3)
+
+    assert df[df.cik == "1"].similar_cik.tolist() == ["2", "3"]
+    assert df[df.cik == "1"]["rank"].tolist() == [1, 2]
+    assert df[df.cik == "1"].similarity.iloc[0] == pytest.approx(1)
+    assert df[df.cik == "3"].similarity.iloc[0] == pytest.approx(
+        0.9 / np.sqrt(0.82) / np.sqrt(2)
+    )
+    assert "4" not in df.cik.tolist() + df.similar_cik.tolist()
+
+
+def test_crowding_scores_securities():
+    m, _, cusips = analytics.build_matrix(
+        holdings(
+            [("1", "AAA", 50), ("1", "BBB", 50), ("2", "AAA", 100), ("3", "BBB", 10)]
+        )
+    )
+
+    df = analytics.crowding(m, cusips)
+
+    assert df.index.tolist() == ["AAA", "BBB"]
+    assert df.loc["AAA"].tolist() == pytest.approx([2, 1.5, 0.75, 1.25 / 2.25])
+    assert df.loc["BBB"].tolist() == pytest.approx([2, 1.5, 0.75, 1.25 / 2.25])
+
+
+def test_active_filings_follow_the_rollup_rules():
+    filings = pd.DataFrame(
+        [
+            ("1", dt(2016, 12, 31), dt(2017, 2, 1), "1-17-000001", None),
+            ("1", dt(2016, 12, 31), dt(2017, 2, 2), "1-17-000002", "NEW HOLDINGS"),
+            ("1", dt(2016, 12, 31), dt(2017, 3, 1), "1-17-000003", "RESTATEMENT"),
+            ("1", dt(2016, 12, 31), dt(2017, 3, 2), "1-17-000004", "NEW HOLDINGS"),
+            ("2", dt(2016, 12, 31), dt(2017, 2, 1), "2-17-000001", "NEW HOLDINGS"),
+            ("2", dt(2016, 12, 31), dt(2017, 2, 1), "2-17-000002", "NEW HOLDINGS"),
+            ("1", dt(2016, 9, 30), dt(2017, 2, 1), "1-17-000005", None),
+        ],
+        columns=[
+            "cik",
+            "periodofreport",
+            "signaturedate",
+            "accnumber",
+            "amendmenttype",
+        ],
+    )
+
+    assert analytics.active_filings(filings).tolist() == [
+        False,
+        False,
+        True,
+        True,
+        True,
+        True,
+        True,
+    ]
+
+
+def test_quarter_holdings_reads_the_reports_of_the_period(monkeypatch):
+    filings = {
+        "1-17-000001.nc": ({"periodOfReport": dt(2016, 12, 31)}, [("AAA", 10)]),
+        "1-17-000002.nc": (
+            {"periodOfReport": dt(2016, 12, 31), "amendmentType": "RESTATEMENT"},
+            [("AAA", 20)],
+        ),
+        "1-17-000003.nc": (
+            {"periodOfReport": dt(2016, 12, 31), "amendmentType": "NEW HOLDINGS"},
+            [("BBB", 5)],
+        ),
+        "1-17-000004.nc": ({"periodOfReport": dt(2016, 9, 30)}, [("CCC", 1)]),
+    }
+
+    def parse_nc(nc):
+        s_dict, rows = filings[nc]
+        s_dict = {"cik": "1", "signatureDate": dt(2017, 2, 1), **s_dict}
+        return (s_dict, pd.DataFrame(rows, columns=["cusip", "value"]))
+
+    monkeypatch.setattr(analytics, "period_ncs", lambda year, quarter: list(filings))
+    monkeypatch.setattr(analytics, "parse_nc", parse_nc)
+
+    df = analytics.quarter_holdings(2016, 4)
+
+    assert df.values.tolist() == [["1", "AAA", 20], ["1", "BBB", 5]]
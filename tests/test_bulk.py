@@ -0,0 +1,33 @@
+from test_load import info_row, write_nc
+
+from onethreef import rollup
+from onethreef.bulk import bulk_load
+from onethreef.constants import _init_connection
+from onethreef.write import run_query
+
+
+def test_bulk_load_syncs_the_rollups_of_swapped_in_companies(
+    database, tmp_path, monkeypatch
+):
+    synced = []
+    sync_rollups = rollup.sync_rollups
+
+    def spy(conn, ciks=None):
+        synced.append(ciks)
+        sync_rollups(conn, ciks=ciks)
+
+    monkeypatch.setattr(rollup, "sync_rollups", spy)
+    nc = write_nc(tmp_path / "0001162781-17-000001.nc", [info_row(i) for i in range(3)])
+
+    assert bulk_load([nc], use_cache=False) == []
+    assert bulk_load([nc], use_cache=False) == []
+    assert synced == [["0001162781"], []]
+
+    conn = _init_connection()
+    try:
+        assert run_query(
+            conn, "SELECT filings, positions, value FROM filer_rollup"
+        ) == [(1, 3, 30)]
+        assert run_query(conn, "SELECT COUNT(*) FROM security_holder") == [(3,)]
+    finally:
+        conn.close()
@@ -0,0 +1,95 @@
+import math
+import os
+from datetime import datetime as dt
+
+import pandas as pd
+import pytest
+
+from onethreef import cache, config
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / ".parse_cache"
+    monkeypatch.setattr(cache, "parse_cache_path", path)
+    monkeypatch.setattr(cache, "_cache_bytes", None)
+
+    return path
+
+
+def entry(i):
+    s_dict = {
+        "cik": f"{i:010d}",
+        "periodOfReport": dt(2016, 12, 31),
+        "signatureDate": dt(2017, 2, 14),
+        "amendmentType": None,
+    }
+    df = pd.DataFrame({"cusip": [f"{i:09d}"], "value": [i * 10]})
+
+    return (s_dict, df)
+
+
+def set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_load_parsed_returns_the_stored_entry(cache_dir):
+    s_dict, df = entry(1)
+    assert cache.load_parsed("v2-a") is None
+
+    cache.store_parsed("v2-a", s_dict, df)
+    loaded_s_dict, loaded_df = cache.load_parsed("v2-a")
+
+    assert loaded_s_dict == s_dict
+    pd.testing.assert_frame_equal(loaded_df, df)
+    assert sorted(os.listdir(cache_dir)) == ["v2-a.feather", "v2-a.json"]
+
+
+def test_load_parsed_touches_the_entry(cache_dir):
+    cache.store_parsed("v2-a", *entry(1))
+    for name in os.listdir(cache_dir):
+        set_mtime(cache_dir / name, 1000)
+
+    cache.load_parsed("v2-a")
+
+    assert all(os.path.getmtime(cache_dir / n) > 1000 for n in os.listdir(cache_dir))
+
+
+def test_evict_drops_whole_entries_by_their_newest_file(cache_dir):
+    for i, key in enumerate(["v2-a", "v2-b", "v2-c"]):
+        cache.store_parsed(key, *entry(i))
+
+    # a's submission is the oldest file, but its info table is the newest one
+    set_mtime(cache_dir / "v2-a.json", 1000)
+    set_mtime(cache_dir / "v2-a.feather", 5000)
+    set_mtime(cache_dir / "v2-b.json", 2000)
+    set_mtime(cache_dir / "v2-b.feather", 2000)
+    set_mtime(cache_dir / "v2-c.json", 3000)
+    set_mtime(cache_dir / "v2-c.feather", 3000)
+
+    size = sum(os.path.getsize(cache_dir / n) for n in os.listdir(cache_dir))
+    b_size = os.path.getsize(cache_dir / "v2-b.json") + os.path.getsize(
+        cache_dir / "v2-b.feather"
+    )
+    cache.evict(max_bytes=math.ceil((size - b_size) / 0.9))
+
+    assert sorted(os.listdir(cache_dir)) == [
+        "v2-a.feather",
+        "v2-a.json",
+        "v2-c.feather",
+        "v2-c.json",
+    ]
+    assert cache._cache_size() == size - b_size
+    assert cache.load_parsed("v2-a") is not None
+
+
+def test_store_parsed_evicts_beyond_the_limit(cache_dir, monkeypatch):
+    cache.store_parsed("v2-a", *entry(1))
+    set_mtime(cache_dir / "v2-a.json", 1000)
+    set_mtime(cache_dir / "v2-a.feather", 1000)
+    size = cache._cache_size()
+
+    monkeypatch.setattr(config, "parse_cache_max_mb", 1.5 * size / 1024 ** 2)
+    cache.store_parsed("v2-b", *entry(2))
+
+    assert sorted(os.listdir(cache_dir)) == ["v2-b.feather", "v2-b.json"]
@@ -0,0 +1,78 @@
+from onethreef import catalog
+from onethreef.fetch import parse_index
+
+form_idx = """Description:           Master Index of EDGAR Dissemination Feed by Form Type
+Last Data Received:    March 31, 2017
+Comments:              webmaster@sec.gov
+Anonymous FTP:         ftp://ftp.sec.gov/edgar/
+
+
+
+
+Form Type   Company Name                                                  CIK         Date Filed  File Name
+---------------------------------------------------------------------------------------------------------------------------------------------
+10-K        SOME CORP                                                     320193      2017-02-14  edgar/data/320193/0000320193-17-000001.txt
+13F-HR      1 800 FLOWERS COM INC                                         1084869     2017-02-14  edgar/data/1084869/0001084869-17-000003.txt
+13F-HR      3M CO                                                         66740       2017-02-10  edgar/data/66740/0000066740-17-000011.txt
+13F-HR/A    ABC FUND 2                                                    1162781     2017-03-01  edgar/data/1162781/0001162781-17-000002.txt
+SC 13G/A    VANGUARD INDEX FUNDS 500                                      36405       2017-02-09  edgar/data/36405/0000932471-17-001234.txt
+SC 13G/A    APPLE INC                                                     320193      2017-02-09  edgar/data/320193/0000932471-17-001234.txt
+"""
+
+
+def test_parse_index_lines_splits_the_columns():
+    rows = list(catalog.parse_index_lines(form_idx.split("\n"), 2017, 1))
+
+    assert [r[1:4] for r in rows] == [
+        (320193, "SOME CORP", "10-K"),
+        (1084869, "1 800 FLOWERS COM INC", "13F-HR"),
+        (66740, "3M CO", "13F-HR"),
+        (1162781, "ABC FUND 2", "13F-HR/A"),
+        (36405, "VANGUARD INDEX FUNDS 500", "SC 13G/A"),
+        (320193, "APPLE INC", "SC 13G/A"),
+    ]
+    assert rows[1] == (
+        "0001084869-17-000003",
+        1084869,
+        "1 800 FLOWERS COM INC",
+        "13F-HR",
+        "2017-02-14",
+        "edgar/data/1084869/0001084869-17-000003.txt",
+        2017,
+        1,
+    )
+
+
+def test_line_regex_skips_the_header():
+    for line in form_idx.split("\n")[:10]:
+        assert catalog.line_regex.match(line) is None
+
+
+def test_update_quarter_round_trip(tmp_path):
+    index_file = tmp_path / "form.idx"
+    index_file.write_text(form_idx, encoding="latin-1")
+    conn = catalog.connect_catalog(tmp_path / "catalog" / "catalog.sqlite")
+
+    try:
+        assert catalog.filing_paths(conn, 2017, 1) is None
+        assert catalog.update_quarter(conn, 2017, 1, index_file=index_file) == 6
+        assert catalog.update_quarter(conn, 2017, 1, index_file=index_file) is None
+        rows = catalog.update_quarter(
+            conn, 2017, 1, refresh=True, index_file=index_file
+        )
+        assert rows == 6
+
+        assert catalog.filing_paths(conn, 2017, 1) == sorted(parse_index(form_idx))
+        assert catalog.filing_paths(conn, 2017, 1, form_type=["SC 13G/A"]) == [
+            (
+                "20170209",
+                "0000932471-17-001234",
+                "edgar/data/320193/0000932471-17-001234.txt",
+            )
+        ]
+        assert catalog.count_filings(conn) == 6
+        assert catalog.count_filings(conn, form_type="SC 13G/A", year=2017) == 2
+        assert catalog.count_filings(conn, cik="0000320193") == 2
+        assert catalog.count_filings(conn, start="2017-02-14", end="2017-03-01") == 3
+    finally:
+        conn.close()
@@ -0,0 +1,145 @@
+import os
+
+import pandas as pd
+import psycopg2
+import pytest
+
+from onethreef import delta
+from onethreef.delta import diff_portfolio, portfolio_columns, position_keys
+
+columns = portfolio_columns[:-1]
+
+
+def infotable(positions):
+    """Builds a preprocessed info table from tuples (cusip, value, putcall)."""
+
+    rows = []
+    for i, (cusip, value, putcall) in enumerate(positions):
+        shares = value // 10
+        issuer = f"ISSUER {cusip}"
+        rows.append(
+            [
+                i,
+                issuer,
+                "COM",
+                cusip,
+                value,
+                shares,
+                "SH",
+                "SOLE",
+                shares,
+                0,
+                0,
+                putcall,
+            ]
+        )
+
+    return pd.DataFrame(rows, columns=columns[:-1]).assign(othermanager=None)
+
+
+filings = [
+    [("AAA", 100, None), ("BBB", 200, None), ("BBB", 50, None)],
+    [("AAA", 110, None), ("BBB", 200, None), ("BBB", 50, None), ("CCC", 10, None)],
+    [("BBB", 200, None), ("CCC", 10, None), ("CCC", 5, "PUT")],
+    [("CCC", 10, None), ("BBB", 200, None), ("DDD", 1, None)],
+    [],
+    [("AAA", 100, None)],
+    [("AAA", 100, None), ("EEE", 7, None)],
+]
+
+
+def apply_delta(prev, rows):
+    """Applies a delta (see diff_portfolio()) to the previous positions in pandas."""
+
+    prev = prev.set_index("position_key")
+    rows = rows.set_index("position_key")
+    current = prev.drop(index=rows.index.intersection(prev.index))
+    changed = rows[rows.op != "R"].drop(columns="op")
+
+    parts = [p for p in [current, changed[current.columns]] if len(p) > 0]
+
+    return pd.concat(parts) if len(parts) > 0 else current
+
+
+def by_key(df):
+    return (
+        df.set_index("position_key")[columns[1:]]
+        .sort_index()
+        .astype(object)
+        .where(lambda df: df.notna(), None)
+    )
+
+
+def test_diff_portfolio_round_trip():
+    prev = infotable([]).assign(position_key=[])
+    for positions in filings:
+        df = infotable(positions)
+        df = df.assign(position_key=position_keys(df))
+        rows = diff_portfolio(prev, df)
+
+        assert set(rows.op) <= {"A", "C", "R"}
+        pd.testing.assert_frame_equal(
+            by_key(apply_delta(prev, rows).reset_index()), by_key(df)
+        )
+        prev = df
+
+
+@pytest.fixture
+def conn():
+    dsn = os.environ.get("ONETHREEF_TEST_DSN")
+    if dsn is None:
+        pytest.skip("ONETHREEF_TEST_DSN isn't set")
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"database isn't reachable: {e}")
+
+    schema = f"onethreef_test_{os.getpid()}"
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema}")
+        cur.execute(
+            "CREATE TABLE filing (filing_id BIGINT PRIMARY KEY, periodofreport TIMESTAMP)"
+        )
+    conn.commit()
+    delta.create_delta_tables(conn)
+    delta.create_delta_table(conn, "0000000001")
+
+    yield conn
+
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+    conn.commit()
+    conn.close()
+
+
+def test_reconstruct_query_round_trip(conn):
+    keyframes = []
+    for filing_id, positions in enumerate(filings, start=1):
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO filing VALUES (%s, %s)",
+                (filing_id, f"{2010 + filing_id}-12-31"),
+            )
+        conn.commit()
+        keyframes.append(
+            delta.add_compact_portfolio(
+                conn, infotable(positions), "0000000001", filing_id, keyframe_interval=3
+            )
+        )
+
+    assert keyframes[0] and not all(keyframes)
+
+    for filing_id, positions in enumerate(filings, start=1):
+        df = infotable(positions)
+        df = df.assign(position_key=position_keys(df))
+        stored = delta._reconstruct(conn, "0000000001", filing_id)
+
+        assert list(stored.portfolio_id) == list(range(len(df)))
+        assert (stored.filing_id == filing_id).all()
+        pd.testing.assert_frame_equal(by_key(stored), by_key(df))
+
+    latest = delta.reconstruct_portfolio(conn, "0000000001")
+    assert list(latest.columns) == portfolio_columns
+    assert (latest.filing_id == len(filings)).all()
+    assert len(latest) == len(filings[-1])
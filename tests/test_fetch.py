@@ -0,0 +1,58 @@
+import pytest
+import requests
+
+from onethreef import fetch
+from onethreef.fetch import parse_index
+
+quarterly = """Form Type   Company Name                                                  CIK         Date Filed  File Name
+---------------------------------------------------------------------------------------------------------------------------------------------
+13F-HR      ABC CAPITAL MANAGEMENT LLC                                    1162781     2013-02-14  edgar/data/1162781/0001162781-13-000002.txt
+13F-HR/A    XYZ ADVISORS INC                                              1000097     2013-03-01  edgar/data/1000097/0001000097-13-000005.txt
+10-K        SOME CORP                                                     320193      2013-02-14  edgar/data/320193/0000320193-13-000001.txt
+"""
+
+daily = """Form Type   Company Name                                                  CIK         Date Filed  File Name
+---------------------------------------------------------------------------------------------------------------------------------------------
+13F-HR      ABC CAPITAL MANAGEMENT LLC                                    1162781     20230103    edgar/data/1162781/0001045672-30-000001.txt
+13F-HR      XYZ ADVISORS INC                                              1000097     20230103    edgar/data/1000097/0000950123-23-000042.txt
+"""
+
+
+def test_parse_index_quarterly():
+    assert parse_index(quarterly) == [
+        (
+            "20130214",
+            "0001162781-13-000002",
+            "edgar/data/1162781/0001162781-13-000002.txt",
+        ),
+        (
+            "20130301",
+            "0001000097-13-000005",
+            "edgar/data/1000097/0001000097-13-000005.txt",
+        ),
+    ]
+
+
+def test_parse_index_daily():
+    filings = parse_index(daily)
+
+    assert [f[0] for f in filings] == ["20230103", "20230103"]
+    assert [f[1] for f in filings] == ["0001045672-30-000001", "0000950123-23-000042"]
+
+
+def test_parse_index_date_not_from_accnumber():
+    for date, accno, path in parse_index(daily) + parse_index(quarterly):
+        assert date not in accno.replace("-", "")
+
+
+def test_fetch_filing_paths_raises_on_missing_index(monkeypatch):
+    def get(url, headers):
+        response = requests.Response()
+        response.status_code = 404
+        response.url = url
+        return response
+
+    monkeypatch.setattr(fetch.requests, "get", get)
+
+    with pytest.raises(requests.HTTPError):
+        fetch.fetch_filing_paths(2099, 1)
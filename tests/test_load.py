@@ -0,0 +1,115 @@
+import pytest
+
+from onethreef import delta, rollup
+from onethreef.constants import _init_connection
+from onethreef.load import load_filings
+from onethreef.write import run_query
+
+submission = """<edgarSubmission xmlns="http://www.sec.gov/edgar/thirteenffiler" xmlns:com="http://www.sec.gov/edgar/common">
+<headerData><filerInfo><filer><credentials><cik>0001162781</cik><ccc>x</ccc></credentials></filer>
+<periodOfReport>12-31-2016</periodOfReport></filerInfo></headerData>
+<formData><coverPage><filingManager><name>ABC Capital</name><address><com:street1>1 Main St</com:street1>
+<com:street2>Floor 2</com:street2><com:city>New York</com:city><com:stateOrCountry>NY</com:stateOrCountry>
+<com:zipCode>10001</com:zipCode></address></filingManager><form13FFileNumber>28-1</form13FFileNumber></coverPage>
+<signatureBlock><signatureDate>02-14-2017</signatureDate></signatureBlock></formData></edgarSubmission>"""
+
+
+def info_row(i, value=None):
+    return (
+        f"<infoTable><nameOfIssuer>Issuer {i}</nameOfIssuer>"
+        f"<titleOfClass>COM</titleOfClass><cusip>{i:09d}</cusip>"
+        f"<value>{i * 10 if value is None else value}</value><shrsOrPrnAmt>"
+        f"<sshPrnamt>{i}</sshPrnamt><sshPrnamtType>SH</sshPrnamtType></shrsOrPrnAmt>"
+        f"<investmentDiscretion>SOLE</investmentDiscretion><votingAuthority>"
+        f"<Sole>{i}</Sole><Shared>0</Shared><None>0</None></votingAuthority></infoTable>"
+    )
+
+
+def write_nc(path, rows):
+    rows = "\n".join(rows)
+    path.write_text(
+        f"<SUBMISSION>\n<XML>\n{submission}\n</XML>\n<XML>\n"
+        '<informationTable xmlns="http://www.sec.gov/edgar/document/thirteenf/informationtable">\n'
+        f"{rows}\n</informationTable>\n</XML>\n</SUBMISSION>\n"
+    )
+
+    return str(path)
+
+
+def stored_positions(conn):
+    if run_query(conn, "SELECT to_regclass('c0001162781')")[0][0] is None:
+        return 0
+
+    return run_query(conn, "SELECT COUNT(*) FROM c0001162781")[0][0]
+
+
+def test_failing_chunk_rolls_back_the_filing(database, tmp_path):
+    nc = tmp_path / "0001162781-17-000001.nc"
+    rows = [info_row(i) for i in range(10)]
+
+    # The second chunk (rows 4 to 7) holds a value that isn't a number
+    write_nc(nc, rows[:5] + [info_row(5, value="n/a")] + rows[6:])
+    with pytest.raises(ValueError):
+        load_filings([str(nc)], chunk_rows=4)
+
+    conn = _init_connection()
+    try:
+        assert stored_positions(conn) == 0
+
+        write_nc(nc, rows)
+        load_filings([str(nc)], chunk_rows=4)
+        assert stored_positions(conn) == 10
+        assert run_query(
+            conn, "SELECT filings, positions, value FROM filer_rollup"
+        ) == [(1, 10, 450)]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_positions_and_rollups_are_written_together(
+    database, tmp_path, monkeypatch, compact
+):
+    nc = write_nc(tmp_path / "0001162781-17-000001.nc", [info_row(i) for i in range(3)])
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("crash before the rollups")
+
+    with monkeypatch.context() as m:
+        m.setattr(rollup, "update_rollups", fail)
+        with pytest.raises(RuntimeError):
+            load_filings([nc], use_cache=False, compact=compact)
+
+    conn = _init_connection()
+    try:
+        assert not delta.check_compact_portfolio_exists(conn, 1)
+        assert stored_positions(conn) == 0
+
+        load_filings([nc], use_cache=False, compact=compact)
+        assert run_query(
+            conn, "SELECT filings, positions, value FROM filer_rollup"
+        ) == [(1, 3, 30)]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_stored_filing_without_rollups_is_repaired(database, tmp_path, compact):
+    nc = write_nc(tmp_path / "0001162781-17-000001.nc", [info_row(i) for i in range(3)])
+    load_filings([nc], use_cache=False, compact=compact)
+
+    conn = _init_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "DELETE FROM rollup_filing; DELETE FROM filer_rollup; DELETE FROM security_rollup"
+            )
+        conn.commit()
+
+        load_filings([nc], use_cache=False, compact=compact)
+        assert run_query(
+            conn, "SELECT filings, positions, value FROM filer_rollup"
+        ) == [(1, 3, 30)]
+        assert run_query(conn, "SELECT COUNT(*) FROM security_rollup") == [(3,)]
+    finally:
+        conn.close()
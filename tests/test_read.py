@@ -0,0 +1,138 @@
+import os
+import tracemalloc
+
+import pandas as pd
+import pytest
+
+from onethreef import read
+from onethreef.read import process_infotable, process_submission, read_nc, stream_nc
+
+submission = """<edgarSubmission xmlns="http://www.sec.gov/edgar/thirteenffiler" xmlns:com="http://www.sec.gov/edgar/common">
+<headerData><filerInfo><filer><credentials><cik>0001162781</cik><ccc>x</ccc></credentials></filer>
+<periodOfReport>12-31-2016</periodOfReport></filerInfo></headerData>
+<formData><coverPage><filingManager><name>ABC Capital</name><address><com:street1>1 Main St</com:street1>
+<com:city>New York</com:city><com:stateOrCountry>NY</com:stateOrCountry><com:zipCode>10001</com:zipCode></address>
+</filingManager><form13FFileNumber>28-1</form13FFileNumber></coverPage>
+<signatureBlock><signatureDate>02-14-2017</signatureDate></signatureBlock></formData></edgarSubmission>"""
+
+
+def info_row(i):
+    put_call = "<putCall>Put</putCall>" if i % 7 == 0 else ""
+    return (
+        f"<infoTable><nameOfIssuer> Issuer {i} </nameOfIssuer>"
+        f"<titleOfClass>com</titleOfClass><cusip>{i:09d}</cusip>"
+        f"<value>{i * 10}</value><shrsOrPrnAmt><sshPrnamt>{i}</sshPrnamt>"
+        f"<sshPrnamtType>SH</sshPrnamtType></shrsOrPrnAmt>{put_call}"
+        f"<investmentDiscretion>SOLE</investmentDiscretion><votingAuthority>"
+        f"<Sole>{i}</Sole><Shared>0</Shared><None>0</None></votingAuthority></infoTable>"
+    )
+
+
+def write_nc(path, n, minified=False):
+    sep = "" if minified else "\n"
+    rows = sep.join(info_row(i) for i in range(n))
+    infotable = (
+        '<informationTable xmlns="http://www.sec.gov/edgar/document/thirteenf/informationtable">'
+        f"{sep}{rows}{sep}</informationTable>"
+    )
+    body = submission.replace("\n", "") if minified else submission
+    with open(path, "w") as f:
+        f.write(
+            sep.join(
+                [
+                    "<SUBMISSION>",
+                    "<XML>",
+                    body,
+                    "</XML>",
+                    "<XML>",
+                    infotable,
+                    "</XML>",
+                    "</SUBMISSION>",
+                ]
+            )
+        )
+
+    return str(path)
+
+
+def streamed(nc, chunk_rows):
+    s_dict, chunks = stream_nc(nc, chunk_rows=chunk_rows)
+    chunks = list(chunks)
+    assert all(len(c) <= chunk_rows for c in chunks)
+
+    return s_dict, pd.concat(chunks, ignore_index=True)
+
+
+@pytest.mark.parametrize("minified", [False, True])
+@pytest.mark.parametrize("block_size", [7, 64, 1 << 16])
+def test_stream_nc_equals_read_nc(tmp_path, monkeypatch, minified, block_size):
+    nc = write_nc(tmp_path / "0001162781-17-000001.nc", 250, minified=minified)
+    monkeypatch.setattr(read, "block_size", block_size)
+
+    s, i = read_nc(nc)
+    s_dict, df = streamed(nc, chunk_rows=40)
+
+    assert s_dict == process_submission(s)
+    pd.testing.assert_frame_equal(df, process_infotable(i))
+
+
+def test_stream_nc_without_infotable(tmp_path):
+    nc = tmp_path / "0001162781-17-000001.nc"
+    nc.write_text(f"<SUBMISSION><XML>{submission}</XML></SUBMISSION>")
+
+    s_dict, chunks = stream_nc(str(nc))
+
+    assert s_dict["cik"] == "0001162781"
+    assert list(chunks) == []
+
+
+def test_stream_nc_without_submission(tmp_path):
+    nc = tmp_path / "0001162781-17-000001.nc"
+    nc.write_text("<SUBMISSION></SUBMISSION>")
+
+    with pytest.raises(ValueError):
+        stream_nc(str(nc))
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_stream_nc_only_opens_file_while_consumed(tmp_path):
+    nc = write_nc(tmp_path / "0001162781-17-000001.nc", 10)
+
+    def open_files():
+        return [
+            os.readlink(os.path.join("/proc/self/fd", fd))
+            for fd in os.listdir("/proc/self/fd")
+            if os.path.exists(os.path.join("/proc/self/fd", fd))
+        ].count(nc)
+
+    s_dict, chunks = stream_nc(nc, chunk_rows=3)
+    assert open_files() == 0
+
+    next(chunks)
+    assert open_files() == 1
+
+    chunks.close()
+    assert open_files() == 0
+
+
+def peak_memory(nc, chunk_rows):
+    list(stream_nc(nc, chunk_rows=chunk_rows)[1])
+    tracemalloc.start()
+    try:
+        s_dict, chunks = stream_nc(nc, chunk_rows=chunk_rows)
+        rows = sum(len(c) for c in chunks)
+        return rows, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("minified", [False, True])
+def test_stream_nc_memory_is_bounded(tmp_path, minified):
+    small = write_nc(tmp_path / "0001162781-17-000001.nc", 500, minified=minified)
+    large = write_nc(tmp_path / "0001162781-17-000002.nc", 4000, minified=minified)
+
+    rows_small, peak_small = peak_memory(small, chunk_rows=100)
+    rows_large, peak_large = peak_memory(large, chunk_rows=100)
+
+    assert (rows_small, rows_large) == (500, 4000)
+    assert peak_large < 1.5 * peak_small
@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from test_load import info_row, write_nc
+
+from onethreef import serve
+from onethreef.load import load_filings
+
+
+def get(path):
+    async def request():
+        async with TestClient(TestServer(serve.create_app(pool_size=2))) as client:
+            response = await client.get(path)
+            assert response.status == 200
+            return [json.loads(line) for line in (await response.text()).splitlines()]
+
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_holders_reads_both_storages(database, tmp_path, monkeypatch, compact):
+    monkeypatch.setattr(serve, "postgres_url", database)
+    rows = [info_row(i) for i in range(3)]
+    load_filings(
+        [
+            write_nc(tmp_path / "0001162781-17-000001.nc", rows),
+            write_nc(
+                tmp_path / "0001162781-17-000002.nc", rows[:2] + [info_row(2, 25)]
+            ),
+        ],
+        use_cache=False,
+        compact=compact,
+    )
+
+    holders = get(f"/holders/{2:09d}")
+    assert [(r["accnumber"], r["value"]) for r in holders] == [
+        ("0001162781-17-000001", 20),
+        ("0001162781-17-000002", 25),
+    ]
+    assert get(f"/holders/{2:09d}?periodofreport=2015-12-31") == []
@@ -0,0 +1,64 @@
+import threading
+
+from onethreef import workqueue
+from onethreef.constants import _init_connection
+from onethreef.write import run_query
+
+
+def test_exit_when_empty_waits_for_running_items(database, monkeypatch):
+    loaded = []
+    monkeypatch.setattr(
+        workqueue, "load_filing", lambda sess, conn, nc, **kwargs: loaded.append(nc)
+    )
+
+    conn = _init_connection()
+    try:
+        workqueue.create_work_table(conn)
+        with conn.cursor() as cur:
+            # Claimed by a worker that dies right after its last heartbeat
+            cur.execute(
+                """
+                INSERT INTO work_item (accnumber, filename, status, worker, attempts, heartbeat)
+                VALUES ('0001162781-17-000001', '/tmp/0001162781-17-000001.nc', 'running', 'dead', 1, now())
+                """
+            )
+        conn.commit()
+
+        result = {}
+        worker = threading.Thread(
+            target=lambda: result.update(
+                loaded=workqueue.run_worker(
+                    worker="alive",
+                    poll_interval=0.1,
+                    heartbeat_interval=0.1,
+                    stale_after=1,
+                    exit_when_empty=True,
+                )
+            )
+        )
+        worker.start()
+        worker.join(timeout=30)
+
+        assert not worker.is_alive()
+        assert result["loaded"] == 1
+        assert loaded == ["/tmp/0001162781-17-000001.nc"]
+        assert run_query(conn, "SELECT status, worker, attempts FROM work_item") == [
+            ("done", "alive", 2)
+        ]
+    finally:
+        conn.close()
+
+
+def test_exit_when_empty_returns_on_finished_queue(database):
+    conn = _init_connection()
+    try:
+        workqueue.create_work_table(conn)
+        with conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO work_item (accnumber, filename, status) VALUES ('a', 'a.nc', 'done'), ('b', 'b.nc', 'failed')"
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert workqueue.run_worker(poll_interval=0.1, exit_when_empty=True) == 0